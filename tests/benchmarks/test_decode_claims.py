@@ -0,0 +1,33 @@
+"""
+Micro-benchmark of the access token decoding, cf `make test-benchmark`.
+
+decode_claims is compared to the jwt.decode call it caches.
+"""
+import jwt
+import pytest
+
+from openedx_sso_security_manager import decode_claims
+from stub_lms import make_access_token
+
+
+@pytest.fixture
+def access_token():
+    return make_access_token("instructor", name="Instructor", email="instructor@example.com")
+
+
+@pytest.mark.benchmark(group="decode_claims")
+def test_benchmark_decode_claims(benchmark, access_token):
+    decode_claims(access_token)
+
+    claims = benchmark(decode_claims, access_token)
+
+    assert claims.preferred_username == "instructor"
+
+
+@pytest.mark.benchmark(group="decode_claims")
+def test_benchmark_jwt_decode(benchmark, access_token):
+    decoded = benchmark(
+        jwt.decode, access_token, algorithms=["HS256"], options={"verify_signature": False}
+    )
+
+    assert decoded["preferred_username"] == "instructor"
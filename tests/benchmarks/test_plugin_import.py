@@ -0,0 +1,72 @@
+"""
+Benchmark of the import of the Tutor plugin, which every tutor command pays for, cf
+`make test-benchmark`.
+
+Each round imports tutorsuperset.plugin afresh, in its own hooks context which is then
+cleared, so that the plugin's hooks are not registered twice.
+"""
+import importlib
+import pathlib
+import sys
+
+import pytest
+from tutor import hooks
+
+CONTEXT = "superset-import-benchmark"
+
+
+@pytest.fixture
+def patch_reads(monkeypatch):
+    """
+    Returns the list of the names of the patch files read since the test started.
+    """
+    reads = []
+    read_text = pathlib.Path.read_text
+
+    def recording_read_text(path, *args, **kwargs):
+        if path.parent.name == "patches":
+            reads.append(path.name)
+        return read_text(path, *args, **kwargs)
+
+    monkeypatch.setattr(pathlib.Path, "read_text", recording_read_text)
+    return reads
+
+
+def import_plugin():
+    with hooks.Contexts.APP(CONTEXT).enter():
+        return importlib.import_module("tutorsuperset.plugin")
+
+
+def unload_plugin():
+    sys.modules.pop("tutorsuperset.plugin", None)
+    hooks.clear_all(context=hooks.Contexts.APP(CONTEXT).name)
+
+
+@pytest.mark.benchmark(group="plugin-import")
+def test_benchmark_plugin_import(benchmark, patch_reads):
+    # Only measure the plugin itself, not Tutor or click
+    importlib.import_module("tutorsuperset")
+    unload_plugin()
+
+    try:
+        plugin = benchmark.pedantic(import_plugin, setup=unload_plugin, rounds=50)
+    finally:
+        unload_plugin()
+
+    assert plugin.__name__ == "tutorsuperset.plugin"
+    # Patch files are only read when their patch is rendered
+    assert patch_reads == []
+
+
+def test_patches_are_read_when_rendered(patch_reads):
+    unload_plugin()
+    try:
+        import_plugin()
+        assert patch_reads == []
+
+        assert list(hooks.Filters.ENV_PATCH(".gitignore").iterate()) == []
+        [caddyfile] = hooks.Filters.ENV_PATCH("caddyfile").iterate()
+        assert "{{ SUPERSET_HOST }}" in caddyfile
+        assert patch_reads == ["caddyfile"]
+    finally:
+        unload_plugin()
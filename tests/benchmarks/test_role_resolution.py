@@ -0,0 +1,192 @@
+"""
+Benchmarks of the role and course access resolution, against the stub LMS, cf
+`make test-benchmark`.
+
+Each benchmark records in its extra_info the p50 and p99 latency of a round, in ms, and
+the number of LMS requests and course list crawls per round, so that they are part of the
+saved and compared results (`--benchmark-save`, `--benchmark-compare`).
+
+Cold benchmarks start each round with empty caches, so that every round crawls the LMS;
+warm ones only hit the caches.
+"""
+import math
+
+import fakeredis
+import pytest
+from cachelib import SimpleCache
+from flask import g
+
+import openedx_jinja_filters
+from openedx_cache import CourseAccessCache, SingleFlight
+from stub_lms import make_course_ids
+
+USERNAME = "instructor"
+COLD_ROUNDS = 20
+
+# (number of courses, LMS page size): from no courses to 10k courses in 100 pages
+COURSE_LISTS = [(0, 100), (100, 100), (1000, 100), (1000, 10), (10_000, 100)]
+COURSE_LIST_IDS = [f"{courses}courses-{page_size}per_page" for courses, page_size in COURSE_LISTS]
+
+# LMS response time per page, in seconds
+LATENCIES = [0, 0.005]
+
+
+class Role:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+def percentile(sorted_data, percent):
+    return sorted_data[max(0, math.ceil(len(sorted_data) * percent / 100) - 1)]
+
+
+def record_stats(benchmark, lms, crawls_per_round=None):
+    """
+    Adds the p50/p99 latency, and the LMS calls per round, to the benchmark's extra_info.
+    """
+    if benchmark.stats is None:
+        # --benchmark-disable: the function only ran once
+        return
+    stats = benchmark.stats.stats
+    rounds = stats.rounds
+    benchmark.extra_info.update(
+        p50_ms=round(percentile(stats.sorted_data, 50) * 1000, 3),
+        p99_ms=round(percentile(stats.sorted_data, 99) * 1000, 3),
+        lms_requests_per_round=len(lms.requests) / rounds,
+        lms_crawls_per_round=lms.crawls() / rounds,
+    )
+    if crawls_per_round is not None:
+        assert lms.crawls() == crawls_per_round * rounds
+
+
+@pytest.fixture
+def course_list(request, lms):
+    """
+    Gives the instructor the parametrized number of courses, served in pages of the
+    parametrized size.
+    """
+    num_courses, page_size = request.param
+    lms.page_size = page_size
+    course_ids = make_course_ids(num_courses, USERNAME)
+    lms.set_courses(USERNAME, course_ids)
+    return course_ids
+
+
+@pytest.fixture
+def clear_caches(app):
+    """
+    Returns a function which empties the course access caches, the results shared by
+    SingleFlight, and the per-request access contexts.
+    """
+
+    def clear():
+        app.config["COURSE_ACCESS_CACHE"] = CourseAccessCache(
+            backend=SimpleCache(), redis=fakeredis.FakeRedis()
+        )
+        app.config["OPENEDX_SINGLE_FLIGHT"] = SingleFlight(
+            backend=SimpleCache(), poll_interval=0.01
+        )
+        g.pop("openedx_access_contexts", None)
+
+    return clear
+
+
+@pytest.fixture
+def jinja_security_manager(monkeypatch, security_manager):
+    """
+    The security manager of the Jinja filters, with an instructor who has the Open edX role.
+    """
+    monkeypatch.setattr(
+        security_manager, "get_user_by_username", lambda username: username, raising=False
+    )
+    monkeypatch.setattr(
+        security_manager, "get_user_roles", lambda user: [Role("Open edX")], raising=False
+    )
+    monkeypatch.setattr(openedx_jinja_filters, "security_manager", security_manager)
+    return security_manager
+
+
+@pytest.mark.benchmark(group="get_courses-cold")
+@pytest.mark.parametrize("latency", LATENCIES)
+@pytest.mark.parametrize("course_list", COURSE_LISTS, ids=COURSE_LIST_IDS, indirect=True)
+def test_benchmark_get_courses_cold(
+    benchmark, lms, course_list, latency, security_manager, user_request, clear_caches
+):
+    lms.latency = latency
+    user_request(USERNAME)
+
+    courses = benchmark.pedantic(
+        security_manager.get_courses, args=(USERNAME,), setup=clear_caches, rounds=COLD_ROUNDS
+    )
+
+    assert courses == course_list
+    record_stats(benchmark, lms, crawls_per_round=1)
+
+
+@pytest.mark.benchmark(group="get_courses-warm")
+@pytest.mark.parametrize("course_list", COURSE_LISTS, ids=COURSE_LIST_IDS, indirect=True)
+def test_benchmark_get_courses_warm(benchmark, lms, course_list, security_manager, user_request):
+    user_request(USERNAME)
+    security_manager.get_courses(USERNAME)
+    lms.reset()
+
+    courses = benchmark(security_manager.get_courses, USERNAME)
+
+    assert courses == course_list
+    record_stats(benchmark, lms, crawls_per_round=0)
+
+
+@pytest.mark.benchmark(group="oauth_user_info")
+@pytest.mark.parametrize("latency", LATENCIES)
+@pytest.mark.parametrize("course_list", COURSE_LISTS, ids=COURSE_LIST_IDS, indirect=True)
+def test_benchmark_oauth_user_info_cold(
+    benchmark, lms, course_list, latency, security_manager, user_request, clear_caches
+):
+    lms.latency = latency
+    user_request(USERNAME)
+
+    user_info = benchmark.pedantic(
+        security_manager.oauth_user_info,
+        args=("openedxsso",),
+        setup=clear_caches,
+        rounds=COLD_ROUNDS,
+    )
+
+    assert user_info["role_keys"] == (["openedx"] if course_list else [])
+    record_stats(benchmark, lms, crawls_per_round=1)
+
+
+@pytest.mark.benchmark(group="oauth_user_info")
+def test_benchmark_oauth_user_info_superuser(benchmark, lms, security_manager, user_request):
+    user_request(USERNAME, superuser=True)
+
+    user_info = benchmark(security_manager.oauth_user_info, "openedxsso")
+
+    assert user_info["role_keys"] == ["admin", "openedx"]
+    record_stats(benchmark, lms, crawls_per_round=0)
+
+
+@pytest.mark.benchmark(group="can_view_courses")
+@pytest.mark.parametrize("course_list", COURSE_LISTS, ids=COURSE_LIST_IDS, indirect=True)
+def test_benchmark_can_view_courses(
+    benchmark, lms, course_list, jinja_security_manager, user_request
+):
+    """
+    Renders the course filter of a new request, with the user's courses cached.
+    """
+    user_request(USERNAME)
+    jinja_security_manager.get_courses(USERNAME)
+    lms.reset()
+
+    def new_request():
+        g.pop("openedx_access_contexts", None)
+
+    sql = benchmark.pedantic(
+        openedx_jinja_filters.can_view_courses, args=(USERNAME,), setup=new_request, rounds=200
+    )
+
+    assert sql == openedx_jinja_filters.course_filter(course_list)
+    record_stats(benchmark, lms, crawls_per_round=0)
@@ -0,0 +1,146 @@
+"""
+Fixtures for the tests of the Superset pythonpath modules.
+
+These modules run inside the Superset image, and Superset is not a dependency of this
+package: the few Superset modules they import are replaced by the minimal stand-ins
+below, and the Open edX APIs by a StubLMS.
+"""
+import os
+import sys
+import types
+from collections import Counter
+
+import fakeredis
+import pytest
+from cachelib import SimpleCache
+from flask import Flask, session
+
+PYTHONPATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tutorsuperset",
+    "templates",
+    "superset",
+    "apps",
+    "pythonpath",
+)
+sys.path.insert(0, PYTHONPATH)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubCelery:
+    def __init__(self):
+        self.sent = []
+
+    def task(self, *args, **kwargs):  # pylint: disable=unused-argument
+        return lambda fn: fn
+
+    def send_task(self, name, args=(), **kwargs):  # pylint: disable=unused-argument
+        self.sent.append((name, args))
+
+
+class StubSupersetSecurityManager:
+    def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+        self.oauth_remotes = {}
+
+
+def _stub_module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules.setdefault(name, module)
+    return sys.modules[name]
+
+
+_stub_module("superset")
+_stub_module("superset.extensions", celery_app=StubCelery(), security_manager=None)
+_stub_module("superset.security", SupersetSecurityManager=StubSupersetSecurityManager)
+
+# pylint: disable=wrong-import-position
+from openedx_cache import CourseAccessCache, SingleFlight  # noqa: E402
+from stub_lms import StubLMS, make_access_token  # noqa: E402
+
+
+class RecordingStatsLogger:
+    """
+    STATS_LOGGER which records the counters and timings it is sent.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = {}
+
+    def incr(self, key):
+        self.counters[key] += 1
+
+    def decr(self, key):
+        self.counters[key] -= 1
+
+    def timing(self, key, value):
+        self.timings.setdefault(key, []).append(value)
+
+    def gauge(self, key, value):
+        self.timings.setdefault(key, []).append(value)
+
+
+@pytest.fixture
+def lms():
+    server = StubLMS().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app(lms):
+    """
+    Flask app with the Open edX settings of superset_config_docker.py, and in-memory caches.
+    """
+    app = Flask(__name__)
+    app.config.update(
+        OPENEDX_API_URLS={"get_courses": lms.courses_url},
+        OPENEDX_API_TIMEOUT=5,
+        OPENEDX_API_MAX_WORKERS=4,
+        OAUTH2_TOKEN_REFRESH_LEEWAY=60,
+        STATS_LOGGER=RecordingStatsLogger(),
+        COURSE_ACCESS_CACHE=CourseAccessCache(backend=SimpleCache(), redis=fakeredis.FakeRedis()),
+        OPENEDX_SINGLE_FLIGHT=SingleFlight(backend=SimpleCache(), poll_interval=0.01),
+        COURSE_FILTER_INLINE_MAX=100,
+        COURSE_FILTER_LARGE_STRATEGY="table",
+        COURSE_ACCESS_TABLE="superset_course_access",
+        COURSE_ACCESS_TABLE_SCHEMA="default",
+        COURSE_ACCESS_TABLE_DATABASE="",
+        COURSE_ACCESS_TABLE_TTL_DAYS=7,
+    )
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def security_manager():
+    from openedx_sso_security_manager import (  # pylint: disable=import-outside-toplevel
+        OpenEdxSsoSecurityManager,
+    )
+
+    # Skip __init__, which configures Flask-AppBuilder's OAuth client
+    manager = OpenEdxSsoSecurityManager.__new__(OpenEdxSsoSecurityManager)
+    manager.oauth_remotes = {"openedxsso": object()}
+    return manager
+
+
+@pytest.fixture
+def user_request(app):
+    """
+    Returns a function which starts a request in the session of the given user.
+    """
+    app.secret_key = "secret"
+    contexts = []
+
+    def start_request(username, **claims):
+        context = app.test_request_context()
+        context.push()
+        contexts.append(context)
+        session["oauth_provider"] = "openedxsso"
+        session["oauth_token"] = {"access_token": make_access_token(username, **claims)}
+        return session["oauth_token"]["access_token"]
+
+    yield start_request
+    for context in reversed(contexts):
+        context.pop()
@@ -0,0 +1,147 @@
+"""
+A local stub of the Open edX courses API, served over HTTP from a background thread.
+"""
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import jwt
+
+COURSES_PATH = "/api/courses/v1/courses/"
+
+
+def make_course_ids(count, username="user"):
+    return [f"course-v1:{username}+C{number:05d}+run" for number in range(count)]
+
+
+def make_access_token(username, expires_in=3600, **claims):
+    """
+    Returns a JWT access token for the user, with the given claims, as issued by the LMS.
+    """
+    claims.update(preferred_username=username, exp=int(time.time()) + expires_in)
+    return jwt.encode(claims, "an-hs256-signing-key-of-32-bytes", algorithm="HS256")
+
+
+class StubLMS:
+    """
+    Serves GET /api/courses/v1/courses/?username=...&permissions=...&page=N with the
+    namespaced pagination of the courses API.
+
+    Each user's courses are set with set_courses(). Every response is delayed by
+    `latency` seconds, and the server records the requests it received.
+    """
+
+    def __init__(self, page_size=10, latency=0.0, report_num_pages=True):
+        self.page_size = page_size
+        self.latency = latency
+        self.report_num_pages = report_num_pages
+        self.courses = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail = False
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def courses_url(self):
+        return f"{self.url}{COURSES_PATH}?permissions={{permission}}&username={{username}}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_courses(self, username, course_ids):
+        self.courses[username] = list(course_ids)
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+            self.max_in_flight = 0
+
+    def crawls(self, username=None):
+        """
+        Returns the number of first page requests, i.e. of course list crawls started.
+        """
+        return sum(
+            1
+            for request in self.requests
+            if request["page"] == 1 and username in (None, request["username"])
+        )
+
+    def page(self, username, page):
+        courses = self.courses.get(username, [])
+        num_pages = max(1, math.ceil(len(courses) / self.page_size))
+        results = [
+            {"course_id": course_id, "name": course_id}
+            for course_id in courses[(page - 1) * self.page_size : page * self.page_size]
+        ]
+        query = {"username": username, "permissions": "staff"}
+        pagination = {
+            "next": (
+                f"{self.url}{COURSES_PATH}?{urlencode({**query, 'page': page + 1})}"
+                if page < num_pages
+                else None
+            ),
+            "previous": None,
+            "count": len(courses),
+        }
+        if self.report_num_pages:
+            pagination["num_pages"] = num_pages
+        else:
+            del pagination["count"]
+        return {"results": results, "pagination": pagination}
+
+    def _make_handler(self):
+        lms = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                request = {
+                    "path": url.path,
+                    "username": query.get("username"),
+                    "page": int(query.get("page", 1)),
+                    "authorization": self.headers.get("Authorization"),
+                }
+                with lms._lock:  # pylint: disable=protected-access
+                    lms.requests.append(request)
+                    lms.in_flight += 1
+                    lms.max_in_flight = max(lms.max_in_flight, lms.in_flight)
+                try:
+                    if lms.latency:
+                        time.sleep(lms.latency)
+                    if lms.fail or url.path != COURSES_PATH:
+                        self.send_error(500 if lms.fail else 404)
+                        return
+                    body = json.dumps(lms.page(request["username"], request["page"])).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with lms._lock:  # pylint: disable=protected-access
+                        lms.in_flight -= 1
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
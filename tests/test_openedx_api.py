@@ -0,0 +1,91 @@
+"""
+Tests of the Open edX API pagination, against the stub LMS.
+"""
+import math
+from functools import partial
+
+import pytest
+import requests
+
+from openedx_api import fetch_json, iter_paginated_results, page_url
+from stub_lms import make_course_ids
+
+
+def fetch_courses(lms, username, max_workers=4):
+    url = lms.courses_url.format(username=username, permission="staff")
+    return [
+        course["course_id"]
+        for course in iter_paginated_results(
+            partial(fetch_json, timeout=5), url, max_workers=max_workers
+        )
+    ]
+
+
+def test_page_url():
+    assert page_url("http://lms/api/?username=a&page=1", 3) == "http://lms/api/?username=a&page=3"
+    assert page_url("http://lms/api/", 2) == "http://lms/api/?page=2"
+
+
+@pytest.mark.parametrize("num_courses", [0, 1, 10, 11, 95])
+def test_all_pages_in_order(lms, num_courses):
+    course_ids = make_course_ids(num_courses)
+    lms.set_courses("staff", course_ids)
+
+    assert fetch_courses(lms, "staff") == course_ids
+    num_pages = max(1, math.ceil(num_courses / lms.page_size))
+    assert sorted(request["page"] for request in lms.requests) == list(range(1, num_pages + 1))
+
+
+def test_pages_are_fetched_concurrently(lms):
+    lms.latency = 0.05
+    lms.set_courses("staff", make_course_ids(90))
+
+    assert len(fetch_courses(lms, "staff", max_workers=4)) == 90
+    assert len(lms.requests) == 9
+    # The first page is fetched alone, then up to max_workers pages at a time
+    assert 1 < lms.max_in_flight <= 4
+
+
+def test_pages_are_followed_without_page_count(lms):
+    lms.report_num_pages = False
+    course_ids = make_course_ids(35)
+    lms.set_courses("staff", course_ids)
+
+    assert fetch_courses(lms, "staff") == course_ids
+    assert [request["page"] for request in lms.requests] == [1, 2, 3, 4]
+    assert lms.max_in_flight == 1
+
+
+def test_many_pages_do_not_recurse(lms):
+    # More pages than Python's default recursion limit
+    lms.page_size = 1
+    course_ids = make_course_ids(1100)
+    lms.set_courses("staff", course_ids)
+
+    assert fetch_courses(lms, "staff", max_workers=8) == course_ids
+
+
+def test_failed_page_raises(lms):
+    lms.set_courses("staff", make_course_ids(30))
+    lms.fail = True
+
+    with pytest.raises(requests.HTTPError):
+        fetch_courses(lms, "staff")
+
+
+def test_fetch_courses(app, lms, security_manager):
+    course_ids = make_course_ids(42, "instructor")
+    lms.set_courses("instructor", course_ids)
+
+    assert security_manager._fetch_courses("instructor", "staff", "token") == course_ids
+    assert {request["authorization"] for request in lms.requests} == {"JWT token"}
+    stats = app.config["STATS_LOGGER"]
+    assert stats.timings["openedx.lms.get_courses.pages"] == [5]
+    assert stats.timings["openedx.course_access.courses"] == [42]
+
+
+def test_fetch_courses_error(app, lms, security_manager):
+    lms.fail = True
+
+    assert security_manager._fetch_courses("instructor", "staff", "token") is None
+    assert app.config["STATS_LOGGER"].counters["openedx.lms.get_courses.error"] == 1
@@ -0,0 +1,266 @@
+"""
+Tests of the course access cache and single-flight lookups, and of their use by the
+security manager.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import fakeredis
+import pandas as pd
+import pytest
+from cachelib import RedisCache, SimpleCache
+
+from openedx_cache import CourseAccessCache, SingleFlight, TieredRedisCache
+from openedx_sso_security_manager import CourseAccessUnavailable
+from stub_lms import make_course_ids
+
+
+def test_get_set():
+    cache = CourseAccessCache(backend=SimpleCache(), timeout=300)
+
+    assert cache.get("staff", "staff") == (None, False)
+    cache.set("staff", "staff", ["course-1"])
+    assert cache.get("staff", "staff") == (["course-1"], False)
+
+    # Other processes only share the L2 cache
+    other_process = CourseAccessCache(backend=cache.backend, timeout=300)
+    assert other_process.get("staff", "staff") == (["course-1"], False)
+    assert other_process.stats()["l2_hits"] == 1
+
+
+def test_concurrent_touches_are_all_recorded():
+    redis = fakeredis.FakeRedis()
+    processes = [CourseAccessCache(redis=redis, key_prefix="test_") for _ in range(2)]
+
+    processes[0].touch("alice", "staff")
+    processes[1].touch("bob", "staff")
+
+    users = {user["username"]: user for user in processes[0].active_users()}
+    assert set(users) == {"alice", "bob"}
+    assert users["bob"]["permission"] == "staff"
+    # Each user has their own key
+    assert redis.exists("test_active_user:staff:alice", "test_active_user:staff:bob") == 2
+
+
+def test_active_users_expire():
+    redis = fakeredis.FakeRedis()
+    cache = CourseAccessCache(redis=redis, active_timeout=120)
+
+    cache.touch("alice", "staff")
+
+    assert 0 < redis.ttl("active_user:staff:alice") <= 120
+    assert [user["username"] for user in cache.active_users()] == ["alice"]
+
+
+def test_inactive_users_are_not_listed():
+    cache = CourseAccessCache(redis=fakeredis.FakeRedis(), active_timeout=3600)
+    cache.touch("alice", "staff")
+    cache.redis.zadd("active_users", {"staff:alice": time.time() - 7200})
+
+    assert cache.active_users() == []
+
+
+def test_get_courses_outside_of_a_request(app, security_manager):
+    with pytest.raises(CourseAccessUnavailable):
+        security_manager.get_courses("instructor")
+
+    app.config["COURSE_ACCESS_CACHE"].set("instructor", "staff", ["course-1"])
+    assert security_manager.get_courses("instructor") == ["course-1"]
+
+
+def test_get_courses_in_a_request(app, lms, security_manager, user_request):
+    course_ids = make_course_ids(25, "instructor")
+    lms.set_courses("instructor", course_ids)
+    access_token = user_request("instructor")
+
+    assert security_manager.get_courses("instructor") == course_ids
+    assert security_manager.get_courses("instructor") == course_ids
+    assert lms.crawls() == 1
+    [user] = app.config["COURSE_ACCESS_CACHE"].active_users()
+    assert user["username"] == "instructor"
+    # The user's access token is never stored in Redis
+    redis = app.config["COURSE_ACCESS_CACHE"].redis
+    assert not any(access_token.encode() in redis.dump(key) for key in redis.keys())
+
+
+def test_stale_courses_are_refreshed_without_the_user_token(
+    app, security_manager, user_request, monkeypatch
+):
+    import openedx_sso_security_manager  # pylint: disable=import-outside-toplevel
+
+    cache = app.config["COURSE_ACCESS_CACHE"]
+    cache.set("instructor", "staff", ["course-1"])
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + cache.timeout + 1)
+    celery_app = openedx_sso_security_manager.celery_app
+    monkeypatch.setattr(celery_app, "sent", [])
+    user_request("instructor")
+
+    assert security_manager.get_courses("instructor") == ["course-1"]
+    assert celery_app.sent == [("openedx.refresh_course_access", ("instructor", "staff"))]
+
+
+def test_get_courses_lms_error(lms, security_manager, user_request):
+    lms.fail = True
+    user_request("instructor")
+
+    with pytest.raises(CourseAccessUnavailable):
+        security_manager.get_courses("instructor")
+
+
+def run_concurrently(fn, callers=50):
+    """
+    Calls fn(i) from `callers` threads at once, and returns the results.
+    """
+    barrier = threading.Barrier(callers)
+
+    def call(i):
+        barrier.wait()
+        return fn(i)
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        return list(executor.map(call, range(callers)))
+
+
+def test_concurrent_course_lookups_share_one_crawl(app, lms, security_manager):
+    lms.latency = 0.1
+    course_ids = make_course_ids(35, "instructor")
+    lms.set_courses("instructor", course_ids)
+
+    def refresh(_):
+        with app.app_context():
+            return security_manager.refresh_courses("instructor", "staff", "token")
+
+    results = run_concurrently(refresh)
+
+    assert results == [course_ids] * 50
+    assert lms.crawls() == 1
+    assert len(lms.requests) == 4
+
+
+def test_concurrent_course_lookups_share_one_crawl_across_processes(app, lms, security_manager):
+    lms.latency = 0.1
+    course_ids = make_course_ids(35, "instructor")
+    lms.set_courses("instructor", course_ids)
+    # One SingleFlight per process, sharing Redis
+    backend = RedisCache(host=fakeredis.FakeRedis())
+    processes = [SingleFlight(backend=backend, poll_interval=0.01) for _ in range(2)]
+
+    def refresh(i):
+        with app.app_context():
+            return processes[i % 2].do(
+                "courses:staff:instructor",
+                partial(security_manager._fetch_courses, "instructor", "staff", "token"),
+            )
+
+    results = run_concurrently(refresh)
+
+    assert results == [course_ids] * 50
+    assert lms.crawls() == 1
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.1)
+        raise ValueError("LMS error")
+
+    def call(_):
+        try:
+            flight.do("key", fail)
+        except ValueError as error:
+            return str(error)
+
+    assert run_concurrently(call, callers=10) == ["LMS error"] * 10
+    assert len(calls) == 1
+
+
+def test_unshared_results_only_share_the_lock_across_processes():
+    redis = fakeredis.FakeRedis()
+    backend = RedisCache(host=redis)
+    processes = [SingleFlight(backend=backend, poll_interval=0.01) for _ in range(2)]
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"access_token": "new-access", "refresh_token": "new-refresh"}
+
+    def call(i):
+        return processes[i % 2].do("refresh_token:key", refresh, waited=lambda: "waited")
+
+    results = run_concurrently(call, callers=10)
+
+    assert len(calls) == 1
+    # The process which made the call shares the new token with its own callers only
+    assert results.count("waited") == 5
+    assert all(b"new-" not in redis.dump(key) for key in redis.keys())
+    # Later calls within result_timeout do not make the call again
+    assert processes[0].do("refresh_token:key", refresh, waited=lambda: "waited") == "waited"
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def tiered_cache():
+    return TieredRedisCache(
+        host=fakeredis.FakeRedis(), codec="arrow", compression_min_size=1, l1_size=10
+    )
+
+
+def test_tiered_cache_preserves_dataframe_dtypes(tiered_cache):
+    df = pd.DataFrame(
+        {
+            "emission_time": pd.to_datetime(["2023-01-01 10:00", "2023-01-02 11:30"]).astype(
+                "datetime64[ns]"
+            ),
+            "verb": pd.Series(["played", "paused"], dtype=object),
+            "course_key": pd.Categorical(["course-v1:a", "course-v1:b"]),
+            "score": pd.array([1, None], dtype="Int64"),
+            "timestamp": pd.to_datetime(["2023-01-01", "2023-01-02"]).tz_localize("UTC"),
+        }
+    )
+    assert df["emission_time"].dtype == "datetime64[ns]"
+    tiered_cache.set("payload", {"df": df, "rowcount": 2})
+    tiered_cache.l1.clear()
+
+    payload = tiered_cache.get("payload")
+
+    assert payload["rowcount"] == 2
+    assert payload["df"].dtypes.equals(df.dtypes)
+    pd.testing.assert_frame_equal(payload["df"], df)
+
+
+def test_tiered_cache_l1_returns_copies(tiered_cache):
+    tiered_cache.set("form_data", {"viz_type": "table"})
+
+    tiered_cache.get("form_data")["viz_type"] = "pie"
+
+    assert tiered_cache.get("form_data") == {"viz_type": "table"}
+
+
+def test_tiered_cache_many(tiered_cache):
+    assert tiered_cache.set_many({"a": 1, "b": "2"}) == ["a", "b"]
+    assert tiered_cache.l1.get("a") is not None
+    tiered_cache._write_client.flushdb()
+
+    # Served by L1
+    assert tiered_cache.get_many("a", "b", "c") == [1, "2", None]
+    assert tiered_cache.get_dict("a", "b") == {"a": 1, "b": "2"}
+
+    tiered_cache.set("c", [3])
+    tiered_cache.delete_many("a", "c")
+    assert tiered_cache.get_many("a", "b", "c") == [None, "2", None]
+
+
+def test_tiered_cache_inc_add():
+    cache = TieredRedisCache(host=fakeredis.FakeRedis())
+
+    assert cache.add("count", 1)
+    assert not cache.add("count", 5)
+    assert cache.inc("count") == 2
+    assert cache.get("count") == 2
@@ -0,0 +1,142 @@
+"""
+Tests of the ClickHouse connection pool and query governor.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import sqlalchemy as sa
+from flask import g
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+import openedx_db
+
+CLICKHOUSE_URL = make_url("clickhousedb://default@clickhouse:8123/xapi")
+
+
+@pytest.fixture
+def governor(app, monkeypatch):
+    app.config.update(
+        AUTH_ROLES_MAPPING={"admin": ["Admin"], "openedx": ["Open edX"]},
+        QUERY_GOVERNOR={
+            "admin": {"clickhouse_settings": {"priority": 1}},
+            "openedx": {"max_concurrent_queries": 2, "clickhouse_settings": {"priority": 3}},
+        },
+        QUERY_GOVERNOR_QUEUE_TIMEOUT=0.1,
+        QUERY_GOVERNOR_SLOTS=openedx_db.QuerySlots(fakeredis.FakeRedis(), poll_interval=0.01),
+        CLICKHOUSE_POOL_MAXSIZE=8,
+        CLICKHOUSE_POOL_NUM_POOLS=4,
+    )
+    monkeypatch.setattr(openedx_db, "_clickhouse_pool_manager", None)
+    openedx_db._user_pool_classes.clear()
+    return app
+
+
+def login(username, *role_names):
+    g.user = SimpleNamespace(
+        username=username,
+        is_authenticated=True,
+        roles=[SimpleNamespace(name=name) for name in role_names],
+    )
+
+
+def mutate(params=None):
+    return openedx_db.mutate_connection(
+        CLICKHOUSE_URL, params or {"poolclass": NullPool}, None, None, None
+    )[1]
+
+
+def test_all_users_share_the_pool_manager(governor):
+    login("staff", "Admin")
+    admin_params = mutate()
+    login("instructor", "Open edX")
+    instructor_params = mutate()
+
+    pool_manager = admin_params["connect_args"]["pool_mgr"]
+    assert instructor_params["connect_args"]["pool_mgr"] is pool_manager
+    assert pool_manager.connection_pool_kw["maxsize"] == 8
+    assert admin_params["poolclass"] is NullPool
+    assert instructor_params["connect_args"]["settings"] == {"priority": 3}
+
+
+def test_user_pool_class_is_cached(governor):
+    login("instructor", "Open edX")
+    poolclass = mutate()["poolclass"]
+
+    assert issubclass(poolclass, NullPool)
+    assert mutate()["poolclass"] is poolclass
+
+
+def test_concurrent_queries_are_bounded_per_user(governor):
+    login("instructor", "Open edX")
+    engines = [sa.create_engine("sqlite://", poolclass=mutate()["poolclass"]) for _ in range(3)]
+    connections = [engines[0].raw_connection(), engines[1].raw_connection()]
+
+    # Another engine, e.g. of the next query, shares the user's slots
+    with pytest.raises(sa.exc.TimeoutError):
+        engines[2].raw_connection()
+
+    # Other users are not affected
+    login("other", "Open edX")
+    engine = sa.create_engine("sqlite://", poolclass=mutate()["poolclass"])
+    engine.raw_connection().close()
+
+    connections.pop().close()
+    engines[2].raw_connection().close()
+    connections.pop().close()
+    # Every slot was released
+    assert governor.config["QUERY_GOVERNOR_SLOTS"].count("instructor") == 0
+
+
+def test_queued_query_runs_when_a_slot_is_released(governor):
+    governor.config["QUERY_GOVERNOR_QUEUE_TIMEOUT"] = 5
+    login("instructor", "Open edX")
+    engine = sa.create_engine("sqlite://", poolclass=mutate()["poolclass"])
+    connections = [engine.raw_connection(), engine.raw_connection()]
+    timer = threading.Timer(0.1, connections[0].close)
+    timer.start()
+
+    engine.raw_connection().close()
+    timer.join()
+    connections[1].close()
+
+
+def test_concurrent_queries_are_bounded_across_processes(governor):
+    login("instructor", "Open edX")
+    engine = sa.create_engine("sqlite://", poolclass=mutate()["poolclass"])
+    connections = [engine.raw_connection(), engine.raw_connection()]
+    # Another process, with its own pool classes, shares the slots in Redis
+    openedx_db._user_pool_classes.clear()
+    other_engine = sa.create_engine("sqlite://", poolclass=mutate()["poolclass"])
+
+    with pytest.raises(sa.exc.TimeoutError):
+        other_engine.raw_connection()
+
+    connections.pop().close()
+    other_engine.raw_connection().close()
+    connections.pop().close()
+
+
+def test_slots_of_crashed_processes_expire(monkeypatch):
+    slots = openedx_db.QuerySlots(fakeredis.FakeRedis(), timeout=60)
+    assert slots.acquire("instructor", 1)
+    assert slots.acquire("instructor", 1) is None
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+
+    assert slots.acquire("instructor", 1)
+
+
+def test_clickhouse_sqlalchemy_only_gets_the_query_slots(governor):
+    login("instructor", "Open edX")
+    url = make_url("clickhouse+http://default@clickhouse:8123/xapi")
+
+    params = openedx_db.mutate_connection(url, {"poolclass": NullPool}, None, None, None)[1]
+
+    # clickhouse-sqlalchemy doesn't accept clickhouse-connect's pool_mgr and settings
+    assert "connect_args" not in params
+    assert issubclass(params["poolclass"], NullPool) and params["poolclass"] is not NullPool
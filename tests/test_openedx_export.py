@@ -0,0 +1,284 @@
+"""
+Tests of the streaming CSV and Parquet exports, against a SQLite database.
+"""
+import csv
+import io
+import os
+import sqlite3
+import sys
+import types
+from types import SimpleNamespace
+
+import jinja2
+import pyarrow.parquet as pq
+import pytest
+import sqlalchemy as sa
+from flask import g
+
+import openedx_export
+
+NUM_ROWS = 25
+CHUNK_SIZE = 10
+
+
+class SupersetSecurityException(Exception):
+    pass
+
+
+class StubSession:
+    """
+    db.session, which finds the given objects by id, or by the filter_by() attributes.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def query(self, model):
+        return StubQuery(self.objects.get(model.__name__, []))
+
+
+class StubQuery:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get(self, object_id):
+        return next((obj for obj in self.objects if obj.id == object_id), None)
+
+    def filter_by(self, **attributes):
+        return StubQuery(
+            [
+                obj
+                for obj in self.objects
+                if all(getattr(obj, name) == value for name, value in attributes.items())
+            ]
+        )
+
+    def one_or_none(self):
+        return self.objects[0] if self.objects else None
+
+
+class TemplateProcessor:
+    def process_template(self, sql, **kwargs):
+        return jinja2.Template(sql).render(**kwargs)
+
+
+class ParsedQuery:
+    def __init__(self, sql):
+        self.sql = sql
+
+    def is_select(self):
+        return self.sql.lstrip().lower().startswith("select")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'xapi.db'}")
+    with engine.begin() as connection:
+        connection.execute(sa.text("create table events (id integer, verb text)"))
+        connection.execute(
+            sa.text("insert into events values (:id, :verb)"),
+            [{"id": i, "verb": f"verb-{i % 3}"} for i in range(NUM_ROWS)],
+        )
+    return engine
+
+
+@pytest.fixture
+def superset(app, engine, monkeypatch):
+    """
+    The Superset modules used by the exports, with an instructor who can export their
+    SQL Lab query 1.
+    """
+    database = SimpleNamespace(
+        get_sqla_engine=lambda schema, user_name: engine,
+        apply_limit_to_sql=lambda sql, limit: f"{sql} limit {limit}",
+    )
+    stubs = SimpleNamespace(
+        access_checks=[],
+        can_csv=True,
+        database=database,
+        objects={
+            "Query": [
+                SimpleNamespace(
+                    id=1,
+                    client_id="query1",
+                    user_id=1,
+                    database=database,
+                    schema=None,
+                    sql="select * from events",
+                    sql_editor_id="1",
+                )
+            ],
+            "TabState": [
+                SimpleNamespace(id=1, user_id=1, template_params=None, saved_query_id=None)
+            ],
+            "SavedQuery": [],
+        },
+    )
+
+    def raise_for_access(**kwargs):
+        stubs.access_checks.append(kwargs)
+
+    security_manager = SimpleNamespace(
+        can_access=lambda permission, view: stubs.can_csv and permission == "can_csv",
+        raise_for_access=raise_for_access,
+    )
+    modules = {
+        "superset.exceptions": {"SupersetSecurityException": SupersetSecurityException},
+        "superset.jinja_context": {
+            "get_template_processor": lambda database, query: TemplateProcessor()
+        },
+        "superset.models": {},
+        "superset.models.sql_lab": {
+            name: type(name, (), {}) for name in ["Query", "SavedQuery", "TabState"]
+        },
+        "superset.models.slice": {"Slice": type("Slice", (), {})},
+        "superset.sql_parse": {"ParsedQuery": ParsedQuery},
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr(
+        "superset.db", SimpleNamespace(session=StubSession(stubs.objects)), raising=False
+    )
+    monkeypatch.setattr("superset.security_manager", security_manager, raising=False)
+
+    app.config.update(
+        CSV_EXPORT={"encoding": "utf-8"},
+        OPENEDX_EXPORT_MODE="stream",
+        OPENEDX_EXPORT_DIR="",
+        OPENEDX_EXPORT_CHUNK_SIZE=CHUNK_SIZE,
+        OPENEDX_EXPORT_MAX_ROWS=0,
+        TESTING=True,
+    )
+    if "openedx_export" not in app.blueprints:
+        app.register_blueprint(openedx_export.export_blueprint)
+    g.user = SimpleNamespace(id=1, username="instructor", is_authenticated=True)
+    return stubs
+
+
+def read_csv(data):
+    return list(csv.reader(io.StringIO(data.decode("utf-8"))))
+
+
+def test_csv_is_encoded_in_chunks(app, engine):
+    app.config["CSV_EXPORT"] = {"encoding": "utf-8"}
+    frames = openedx_export.iter_frames(engine, "select * from events", CHUNK_SIZE)
+
+    chunks = list(openedx_export.iter_csv(frames))
+
+    assert len(chunks) == 3
+    rows = read_csv(b"".join(chunks))
+    # One header row
+    assert rows[0] == ["id", "verb"]
+    assert [int(row[0]) for row in rows[1:]] == list(range(NUM_ROWS))
+
+
+def test_parquet_is_encoded_in_chunks(engine):
+    frames = openedx_export.iter_frames(engine, "select * from events", CHUNK_SIZE)
+
+    chunks = list(openedx_export.iter_parquet(frames))
+
+    # One chunk per row group, then the footer
+    assert len(chunks) == 4
+    parquet_file = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet_file.metadata.num_row_groups == 3
+    assert parquet_file.read().column("id").to_pylist() == list(range(NUM_ROWS))
+
+
+def test_sqllab_export_is_streamed(app, superset):
+    response = app.test_client().get("/openedx/export/sqllab/query1.csv")
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == 'attachment; filename="query_query1.csv"'
+    assert len(read_csv(response.data)) == NUM_ROWS + 1
+    assert superset.access_checks == [{"query": superset.objects["Query"][0]}]
+
+
+def test_sqllab_export_is_rendered_with_the_template_params(app, superset):
+    [query] = superset.objects["Query"]
+    query.sql = "select * from events where verb = '{{ verb }}'"
+    superset.objects["TabState"][0].saved_query_id = 2
+    superset.objects["SavedQuery"].append(
+        SimpleNamespace(id=2, template_parameters='{"verb": "verb-1"}')
+    )
+    app.config["OPENEDX_EXPORT_MAX_ROWS"] = 5
+
+    response = app.test_client().get("/openedx/export/sqllab/query1.csv")
+
+    assert [row[1] for row in read_csv(response.data)[1:]] == ["verb-1"] * 5
+
+
+def test_chart_export(app, superset):
+    query_obj = SimpleNamespace(row_limit=None, to_dict=lambda: {"verb": "verb-2"})
+    datasource = SimpleNamespace(
+        database=superset.database,
+        schema=None,
+        get_query_str=lambda query: f"select * from events where verb = '{query['verb']}'",
+    )
+    query_context = SimpleNamespace(queries=[query_obj], datasource=datasource)
+    superset.objects["Slice"] = [SimpleNamespace(id=7, get_query_context=lambda: query_context)]
+    app.config["OPENEDX_EXPORT_MAX_ROWS"] = 1000
+
+    response = app.test_client().get("/openedx/export/chart/7.csv")
+
+    assert [row[1] for row in read_csv(response.data)[1:]] == ["verb-2"] * 8
+    assert query_obj.row_limit == 1000
+    assert superset.access_checks == [{"query_context": query_context}]
+    assert app.test_client().get("/openedx/export/chart/8.csv").status_code == 404
+
+
+def test_file_export_is_removed_once_sent(app, superset, tmp_path):
+    export_dir = tmp_path / "exports"
+    app.config.update(OPENEDX_EXPORT_MODE="file", OPENEDX_EXPORT_DIR=str(export_dir))
+
+    response = app.test_client().get("/openedx/export/sqllab/query1.parquet")
+
+    assert response.status_code == 200
+    assert pq.read_table(io.BytesIO(response.data)).num_rows == NUM_ROWS
+    response.close()
+    assert os.listdir(export_dir) == []
+
+
+def test_failed_file_export_is_removed(app, superset, tmp_path):
+    export_dir = tmp_path / "exports"
+    app.config.update(OPENEDX_EXPORT_MODE="file", OPENEDX_EXPORT_DIR=str(export_dir))
+    superset.objects["Query"][0].sql = "select * from missing_table"
+
+    with pytest.raises(sqlite3.OperationalError):
+        app.test_client().get("/openedx/export/sqllab/query1.csv")
+
+    assert os.listdir(export_dir) == []
+
+
+@pytest.mark.parametrize(
+    "denial, status_code",
+    [
+        ("anonymous", 401),
+        ("no_can_csv", 403),
+        ("no_query_access", 403),
+        ("other_owner", 404),
+        ("not_select", 400),
+    ],
+)
+def test_export_access(app, superset, monkeypatch, denial, status_code):
+    [query] = superset.objects["Query"]
+    if denial == "anonymous":
+        g.user.is_authenticated = False
+    elif denial == "no_can_csv":
+        superset.can_csv = False
+    elif denial == "no_query_access":
+
+        def raise_for_access(**kwargs):
+            raise SupersetSecurityException("No access to the database")
+
+        monkeypatch.setattr("superset.security_manager.raise_for_access", raise_for_access)
+    elif denial == "other_owner":
+        query.user_id = 2
+    elif denial == "not_select":
+        query.sql = "drop table events"
+
+    response = app.test_client().get("/openedx/export/sqllab/query1.csv")
+
+    assert response.status_code == status_code
@@ -0,0 +1,161 @@
+"""
+Tests of the incremental Superset initialization, against a SQLite metadata database.
+"""
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+pytest.importorskip("alembic")
+
+# pylint: disable=wrong-import-position
+import openedx_init  # noqa: E402
+from openedx_init import StepRunner, import_roles  # noqa: E402
+
+Base = orm.declarative_base()
+
+role_permissions = sa.Table(
+    "ab_permission_view_role",
+    Base.metadata,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("permission_view_id", sa.Integer, sa.ForeignKey("ab_permission_view.id")),
+    sa.Column("role_id", sa.Integer, sa.ForeignKey("ab_role.id")),
+)
+
+
+class Permission(Base):
+    __tablename__ = "ab_permission"
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(100), unique=True, nullable=False)
+
+
+class ViewMenu(Base):
+    __tablename__ = "ab_view_menu"
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(250), unique=True, nullable=False)
+
+
+class PermissionView(Base):
+    __tablename__ = "ab_permission_view"
+    id = sa.Column(sa.Integer, primary_key=True)
+    permission_id = sa.Column(sa.Integer, sa.ForeignKey("ab_permission.id"))
+    permission = orm.relationship("Permission")
+    view_menu_id = sa.Column(sa.Integer, sa.ForeignKey("ab_view_menu.id"))
+    view_menu = orm.relationship("ViewMenu")
+
+
+class Role(Base):
+    __tablename__ = "ab_role"
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(64), unique=True, nullable=False)
+    permissions = orm.relationship("PermissionView", secondary=role_permissions)
+
+
+class SecurityManager:
+    """
+    The parts of Flask-AppBuilder's SQLAlchemy security manager used by import_roles.
+    """
+
+    permission_model = Permission
+    viewmenu_model = ViewMenu
+    permissionview_model = PermissionView
+    role_model = Role
+
+    def __init__(self, session):
+        self.get_session = session
+
+    def find_role(self, name):
+        return self.get_session.query(Role).filter_by(name=name).one_or_none()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return sa.create_engine(f"sqlite:///{tmp_path / 'superset.db'}")
+
+
+@pytest.fixture
+def security_manager(engine):
+    Base.metadata.create_all(engine)
+    session = orm.sessionmaker(bind=engine)()
+    yield SecurityManager(session)
+    session.close()
+
+
+def get_role_permissions(security_manager, role_name):
+    role = security_manager.find_role(role_name)
+    return {
+        (permission_view.permission.name, permission_view.view_menu.name)
+        for permission_view in role.permissions
+    }
+
+
+def test_steps_only_run_when_their_fingerprint_changes(engine):
+    calls = []
+
+    def step(previous_data):
+        calls.append(previous_data)
+        return f"data-{len(calls)}"
+
+    runner = StepRunner(engine)
+    assert runner.run("roles", "fingerprint-1", step)
+    assert not StepRunner(engine).run("roles", "fingerprint-1", step)
+    assert StepRunner(engine).run("roles", "fingerprint-2", step)
+    # e.g. the roles step, after the migrations ran
+    assert StepRunner(engine).run("roles", "fingerprint-2", step, force=True)
+    assert StepRunner(engine, force=True).run("roles", "fingerprint-2", step)
+
+    # Each run gets the data returned by the previous one
+    assert calls == [None, "data-1", "data-2", "data-3"]
+    assert StepRunner(engine).get("roles") == ("fingerprint-2", "data-4")
+    assert [status for _step, status, _elapsed in runner.timings] == ["done"]
+
+
+def test_failed_steps_run_again(engine):
+    def fail(previous_data):
+        raise RuntimeError("superset init failed")
+
+    with pytest.raises(RuntimeError):
+        StepRunner(engine).run("migrations", "fingerprint", fail)
+
+    assert StepRunner(engine).get("migrations") == (None, None)
+
+
+def test_first_import_only_keeps_the_listed_permissions(security_manager):
+    import_roles(security_manager, {"Open edX": {("can_read", "Chart")}}, {})
+    import_roles(security_manager, {"Open edX": {("can_read", "Dataset")}}, {})
+    assert get_role_permissions(security_manager, "Open edX") == {
+        ("can_read", "Chart"),
+        ("can_read", "Dataset"),
+    }
+
+    # Without previous roles, e.g. on the first run, the current permissions are revoked
+    import_roles(security_manager, {"Open edX": {("can_read", "Dashboard")}}, None)
+
+    assert get_role_permissions(security_manager, "Open edX") == {("can_read", "Dashboard")}
+
+
+def test_import_applies_the_diff_with_the_previous_roles(security_manager):
+    previous_roles = {"Open edX": {("can_read", "Chart"), ("can_read", "Dataset")}}
+    import_roles(security_manager, previous_roles, None)
+    # Granted by `superset init`, not by the roles file
+    import_roles(security_manager, {"Open edX": {("can_read", "Database")}}, {})
+
+    roles = {"Open edX": {("can_read", "Chart"), ("can_write", "Chart")}, "Viewer": set()}
+    import_roles(security_manager, roles, previous_roles)
+
+    assert get_role_permissions(security_manager, "Open edX") == {
+        ("can_read", "Chart"),
+        ("can_write", "Chart"),
+        ("can_read", "Database"),
+    }
+    assert get_role_permissions(security_manager, "Viewer") == set()
+    # Permissions and view menus are shared, not duplicated
+    session = security_manager.get_session
+    assert session.query(Permission).count() == 2
+    assert session.query(ViewMenu).count() == 3
+    assert session.query(PermissionView).count() == 4
+
+
+def test_fingerprints_depend_on_every_value():
+    assert openedx_init.fingerprint("a", "b") == openedx_init.fingerprint("a", "b")
+    assert openedx_init.fingerprint("a", "b") != openedx_init.fingerprint("ab", "")
+    assert openedx_init.fingerprint("a", key=b"secret") != openedx_init.fingerprint("a")
@@ -0,0 +1,125 @@
+"""
+Tests of the course filters rendered by can_view_courses.
+"""
+import pytest
+
+import openedx_db
+from openedx_jinja_filters import NO_COURSES, course_filter
+from stub_lms import make_course_ids
+
+
+class StubClickHouseClient:
+    def __init__(self):
+        self.commands = []
+        self.inserts = []
+
+    def command(self, sql):
+        self.commands.append(sql)
+
+    def insert(self, table, rows, column_names, database):
+        self.inserts.append((table, list(rows), column_names, database))
+
+
+class StubEngine:
+    def __init__(self, client):
+        self.client = client
+
+    def raw_connection(self):
+        engine = self
+
+        class Connection:
+            connection = engine
+
+            def close(self):
+                pass
+
+        return Connection()
+
+
+@pytest.fixture
+def clickhouse(app, monkeypatch):
+    client = StubClickHouseClient()
+    app.config["COURSE_ACCESS_TABLE_DATABASE"] = "ClickHouse"
+    monkeypatch.setattr(openedx_db, "get_course_access_engine", lambda: StubEngine(client))
+    monkeypatch.setattr(openedx_db, "_course_access_table_created", False)
+    openedx_db._written_access_keys.clear()
+    return client
+
+
+def test_no_courses(app):
+    assert course_filter([]) == NO_COURSES
+
+
+def test_inline_filter_is_canonical(app):
+    assert course_filter(["b", "a'x", "b"], "course_key") == r"course_key in ('a\'x', 'b')"
+    assert course_filter(["b", "a"]) == course_filter(["a", "b", "a"])
+
+
+def test_long_list_is_inline_without_access_table_database(app):
+    course_ids = make_course_ids(500)
+
+    assert course_filter(course_ids).startswith("course_id in ('course-v1:")
+    assert app.config["STATS_LOGGER"].counters["openedx.course_filter.inline"] == 1
+
+
+def test_table_filter(app, clickhouse):
+    course_ids = make_course_ids(5000)
+
+    sql = course_filter(reversed(course_ids))
+
+    assert len(sql) < 150
+    assert sql == course_filter(course_ids)
+    assert sql.startswith(
+        "course_id in (select course_id from default.superset_course_access where access_key = '"
+    )
+    assert sql.split("'")[1] == openedx_db.write_course_access(course_ids)
+    # Rendering the filter doesn't write to ClickHouse
+    assert len(clickhouse.inserts) == 1
+
+
+def test_table_filter_changes_with_the_courses(app, clickhouse):
+    course_ids = make_course_ids(500)
+
+    assert course_filter(course_ids) != course_filter(course_ids[1:])
+    assert clickhouse.inserts == []
+
+
+def test_courses_are_written_when_fetched(app, clickhouse, lms, security_manager):
+    course_ids = make_course_ids(500, "instructor")
+    lms.set_courses("instructor", reversed(course_ids))
+
+    assert security_manager.refresh_courses("instructor", "staff", "token") == course_ids[::-1]
+    security_manager.refresh_courses("instructor", "staff", "token")
+
+    # The table is created, and each list written, once per process
+    assert len(clickhouse.commands) == 1
+    assert clickhouse.commands[0].startswith(
+        "CREATE TABLE IF NOT EXISTS default.superset_course_access ("
+    )
+    assert "TTL updated_on + INTERVAL 7 DAY" in clickhouse.commands[0]
+    [(table, rows, column_names, database)] = clickhouse.inserts
+    assert (table, database) == ("superset_course_access", "default")
+    assert column_names == ["access_key", "course_id"]
+    assert [course_id for _, course_id in rows] == course_ids
+    [access_key] = {access_key for access_key, _ in rows}
+    assert f"access_key = '{access_key}'" in course_filter(course_ids)
+
+
+def test_short_course_lists_are_not_written(app, clickhouse, lms, security_manager):
+    lms.set_courses("instructor", make_course_ids(100, "instructor"))
+
+    security_manager.refresh_courses("instructor", "staff", "token")
+
+    assert clickhouse.inserts == []
+
+
+def test_courses_are_not_cached_unless_written(app, clickhouse, lms, security_manager):
+    def insert(*args, **kwargs):
+        raise ConnectionError("ClickHouse is down")
+
+    clickhouse.insert = insert
+    course_ids = make_course_ids(500, "instructor")
+    lms.set_courses("instructor", course_ids)
+
+    assert security_manager.refresh_courses("instructor", "staff", "token") == course_ids
+    assert app.config["COURSE_ACCESS_CACHE"].get("instructor", "staff") == (None, False)
@@ -0,0 +1,105 @@
+"""
+Tests of the Open edX SSO security manager.
+"""
+from types import SimpleNamespace
+
+import fakeredis
+import jwt
+from cachelib import RedisCache
+from flask import session
+
+import openedx_sso_security_manager
+from openedx_cache import LRUCache, SingleFlight
+from openedx_sso_security_manager import (
+    AccessTokenClaims,
+    decode_claims,
+    get_service_access_token,
+)
+from stub_lms import make_access_token
+
+
+def test_claims_are_decoded_once_per_token(monkeypatch):
+    calls = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(openedx_sso_security_manager.jwt, "decode", counting_decode)
+    access_token = make_access_token("instructor", administrator=True)
+    other_token = make_access_token("other")
+    for _ in range(100):
+        claims = decode_claims(access_token)
+        decode_claims(other_token)
+
+    assert len(calls) == 2
+    assert isinstance(claims, AccessTokenClaims)
+    assert claims.preferred_username == "instructor"
+    assert claims.administrator and not claims.superuser
+    # Immutable, and without a per-instance __dict__
+    assert not hasattr(claims, "__dict__")
+
+
+def test_service_access_token_is_cached(app, monkeypatch):
+    requests = []
+
+    def post_form(url, data, timeout):  # pylint: disable=unused-argument
+        requests.append(data)
+        return {"access_token": make_access_token("superset-service")}
+
+    monkeypatch.setattr(openedx_sso_security_manager, "post_form", post_form)
+    monkeypatch.setattr(openedx_sso_security_manager, "_service_token_cache", LRUCache(max_size=1))
+    app.config.update(
+        OAUTH_PROVIDERS=[
+            {"name": "openedxsso", "remote_app": {"access_token_url": "http://lms/token"}}
+        ],
+        OPENEDX_SERVICE_CLIENT_ID="service-id",
+        OPENEDX_SERVICE_CLIENT_SECRET="service-secret",
+    )
+
+    token = get_service_access_token()
+
+    assert get_service_access_token() == token
+    assert decode_claims(token).preferred_username == "superset-service"
+    assert requests == [
+        {
+            "grant_type": "client_credentials",
+            "client_id": "service-id",
+            "client_secret": "service-secret",
+            "token_type": "jwt",
+        }
+    ]
+
+
+def test_claims_of_expired_tokens_are_not_cached():
+    expired_token = make_access_token("instructor", expires_in=-60)
+
+    assert decode_claims(expired_token).preferred_username == "instructor"
+    fingerprint = openedx_sso_security_manager.token_fingerprint(expired_token)
+    claims_cache = openedx_sso_security_manager._claims_cache  # pylint: disable=protected-access
+    assert claims_cache.get(fingerprint) is None
+
+
+def test_refreshed_tokens_are_not_shared_through_redis(
+    app, security_manager, user_request, monkeypatch
+):
+    redis = fakeredis.FakeRedis()
+    app.config["OPENEDX_SINGLE_FLIGHT"] = SingleFlight(backend=RedisCache(host=redis))
+    oauth_remote = SimpleNamespace(
+        access_token_url="http://lms/token", client_id="id", client_secret="secret"
+    )
+    monkeypatch.setattr(security_manager, "oauth_remotes", {"openedxsso": oauth_remote})
+    new_token = {"access_token": make_access_token("instructor"), "refresh_token": "new-refresh"}
+    monkeypatch.setattr(
+        openedx_sso_security_manager, "post_form", lambda url, data, timeout: dict(new_token)
+    )
+    user_request("instructor")
+    token = dict(session["oauth_token"], refresh_token="old-refresh")
+
+    assert security_manager.refresh_oauth_token(token)["refresh_token"] == "new-refresh"
+    assert session["oauth_token"]["refresh_token"] == "new-refresh"
+    assert all(b"refresh" not in redis.dump(key) for key in redis.keys())
+    # Other sessions with the same refresh token keep their own token
+    session["oauth_token"] = token
+    assert security_manager.refresh_oauth_token(token) is None
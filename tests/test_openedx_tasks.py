@@ -0,0 +1,53 @@
+"""
+Tests of the dashboard warm-up Celery tasks.
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import openedx_tasks
+from openedx_tasks import can_warm_for
+
+
+def make_user(username, *role_names):
+    return SimpleNamespace(
+        username=username, roles=[SimpleNamespace(name=name) for name in role_names]
+    )
+
+
+@pytest.mark.parametrize("role_name", ["Admin", "Alpha"])
+def test_global_staff_are_warmed(app, role_name):
+    assert can_warm_for(make_user("staff", role_name, "Open edX"))
+
+
+def test_course_staff_are_warmed_with_fresh_courses(app):
+    app.config["COURSE_ACCESS_CACHE"].set("instructor", "staff", ["course-v1:a+b+c"])
+
+    assert can_warm_for(make_user("instructor", "Open edX"))
+
+
+def test_course_staff_are_not_warmed_without_cached_courses(app):
+    assert not can_warm_for(make_user("instructor", "Open edX"))
+
+
+def test_course_staff_are_not_warmed_with_stale_courses(app, monkeypatch):
+    cache = app.config["COURSE_ACCESS_CACHE"]
+    cache.set("instructor", "staff", ["course-v1:a+b+c"])
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + cache.timeout + 1)
+
+    assert not can_warm_for(make_user("instructor", "Open edX"))
+
+
+def test_course_access_is_refreshed_with_the_service_token(app, monkeypatch):
+    refreshed = []
+    security_manager = SimpleNamespace(
+        refresh_courses=lambda *args: refreshed.append(args) or ["course-v1:a+b+c"]
+    )
+    monkeypatch.setattr(openedx_tasks, "security_manager", security_manager)
+    monkeypatch.setattr(openedx_tasks, "get_service_access_token", lambda: "service")
+
+    openedx_tasks.refresh_course_access("instructor", "staff")
+
+    assert refreshed == [("instructor", "staff", "service")]
@@ -0,0 +1,40 @@
+"""
+Tests of the superset-warm-access job, against the stub LMS.
+"""
+
+import pytest
+
+import openedx_sso_security_manager
+import openedx_warm_access
+from stub_lms import make_course_ids
+
+
+@pytest.fixture
+def warm(app, monkeypatch, security_manager):
+    monkeypatch.setattr("superset.security_manager", security_manager, raising=False)
+    monkeypatch.setattr(openedx_sso_security_manager, "get_service_access_token", lambda: "service")
+    monkeypatch.setattr(
+        openedx_warm_access,
+        "get_active_usernames",
+        lambda days: ["alice", "bob", "carol"],
+    )
+    return lambda: openedx_warm_access.warm_access(app, concurrency=2, rate=0)
+
+
+def test_warm_access(app, lms, warm):
+    for username in ["alice", "bob", "carol"]:
+        lms.set_courses(username, make_course_ids(15, username))
+
+    assert warm()
+    # Every user's courses are listed to the service user
+    assert lms.crawls() == 3
+    assert {request["authorization"] for request in lms.requests} == {"JWT service"}
+    cache = app.config["COURSE_ACCESS_CACHE"]
+    assert cache.get("bob", "staff") == (make_course_ids(15, "bob"), False)
+
+
+def test_warm_access_failures(lms, warm, capsys):
+    lms.fail = True
+
+    assert not warm()
+    assert "Warmed: 0, failed: 3" in capsys.readouterr().out
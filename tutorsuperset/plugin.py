@@ -1,11 +1,21 @@
-import os
-from glob import glob
+import sys
+import typing as t
 
-import pkg_resources
-from tutor import hooks
+import click
+from tutor import env, hooks
+from tutor.types import Config
 
 from .__about__ import __version__
 
+if sys.version_info >= (3, 9):
+    from importlib.resources import files
+
+    PACKAGE_ROOT = files("tutorsuperset")
+else:
+    import pathlib
+
+    PACKAGE_ROOT = pathlib.Path(__file__).parent
+
 ########################################
 # CONFIGURATION
 ########################################
@@ -17,6 +27,11 @@ hooks.Filters.CONFIG_DEFAULTS.add_items(
         # Prefix your setting names with 'SUPERSET_'.
         ("SUPERSET_VERSION", __version__),
         ("SUPERSET_TAG", "2.0.1"),
+        # Set it to another image, e.g.
+        # "{{ DOCKER_REGISTRY }}openedx/superset:{{ SUPERSET_TAG }}-{{ SUPERSET_VERSION }}",
+        # to build it from the SUPERSET_TAG image, with the local requirements
+        # pre-installed, with `tutor images build superset`.
+        ("SUPERSET_DOCKER_IMAGE", "apache/superset:{{ SUPERSET_TAG }}"),
         ("SUPERSET_HOST", "superset.{{ LMS_HOST }}"),
         ("SUPERSET_PORT", "8088"),
         ("SUPERSET_DB_DIALECT", "mysql"),
@@ -24,17 +39,258 @@ hooks.Filters.CONFIG_DEFAULTS.add_items(
         ("SUPERSET_DB_PORT", "{{ MYSQL_PORT }}"),
         ("SUPERSET_DB_NAME", "superset"),
         ("SUPERSET_DB_USERNAME", "superset"),
+        # Per-role limits of the ClickHouse queries, keyed by role: "admin", "alpha"
+        # (global staff) and "openedx" (course staff). The first role the user has
+        # applies. "max_concurrent_queries" is per user, across all Superset processes.
+        # "max_execution_time" (in seconds) also applies to SQL Lab queries: it only
+        # approximates a SQL Lab timeout, as it does not count the time spent waiting for
+        # a query slot or fetching the results. "priority" is lower for more important
+        # queries. Course staff queries which return more than "max_result_rows" fail,
+        # rather than silently return truncated results as with result_overflow_mode
+        # "break".
+        (
+            "SUPERSET_QUERY_GOVERNOR",
+            {
+                "admin": {
+                    "max_concurrent_queries": 8,
+                    "clickhouse_settings": {
+                        "max_execution_time": 600,
+                        "max_memory_usage": 20_000_000_000,
+                        "priority": 1,
+                    },
+                },
+                "alpha": {
+                    "max_concurrent_queries": 6,
+                    "clickhouse_settings": {
+                        "max_execution_time": 300,
+                        "max_memory_usage": 10_000_000_000,
+                        "priority": 2,
+                    },
+                },
+                "openedx": {
+                    "max_concurrent_queries": 3,
+                    "clickhouse_settings": {
+                        "max_execution_time": 120,
+                        "max_memory_usage": 5_000_000_000,
+                        "priority": 3,
+                        "max_result_rows": 1_000_000,
+                        "result_overflow_mode": "throw",
+                    },
+                },
+            },
+        ),
+        ("SUPERSET_QUERY_GOVERNOR_QUEUE_TIMEOUT", 10),
+        # Seconds after which the query slot of a crashed process is released. Longer
+        # than the longest max_execution_time, so that running queries keep their slot.
+        ("SUPERSET_QUERY_GOVERNOR_SLOT_TIMEOUT", 900),
+        # Run chart queries asynchronously on the Celery workers
+        ("SUPERSET_GLOBAL_ASYNC_QUERIES", False),
+        ("SUPERSET_GLOBAL_ASYNC_QUERIES_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_GLOBAL_ASYNC_QUERIES_REDIS_DB", 4),
+        ("SUPERSET_GLOBAL_ASYNC_QUERIES_POLLING_DELAY", 500),
+        # Connection pool of the metadata database, in each web and worker process
+        ("SUPERSET_DB_POOL_SIZE", 5),
+        ("SUPERSET_DB_POOL_MAX_OVERFLOW", 10),
+        ("SUPERSET_DB_POOL_TIMEOUT", 30),
+        ("SUPERSET_DB_POOL_RECYCLE", 3600),
+        ("SUPERSET_DB_POOL_PRE_PING", True),
+        # Maximum HTTP connections to each ClickHouse server, in each web and worker process
+        ("SUPERSET_CLICKHOUSE_POOL_MAXSIZE", 8),
+        ("SUPERSET_CLICKHOUSE_POOL_NUM_POOLS", 4),
         ("SUPERSET_OAUTH2_ACCESS_TOKEN_PATH", "/oauth2/access_token/"),
         ("SUPERSET_OAUTH2_AUTHORIZE_PATH", "/oauth2/authorize/"),
+        # Refresh OAuth tokens this many seconds before they expire.
+        ("SUPERSET_OAUTH2_TOKEN_REFRESH_LEEWAY", 60),
         (
             "SUPERSET_OPENEDX_COURSES_LIST_PATH",
             "/api/courses/v1/courses/?permissions={permission}&username={username}",
         ),
+        ("SUPERSET_OPENEDX_API_TIMEOUT", 30),
+        # Number of pages of API results to fetch concurrently.
+        ("SUPERSET_OPENEDX_API_MAX_WORKERS", 4),
         ("SUPERSET_OPENEDX_ROLE_NAME", "Open edX"),
+        # How long (in seconds) to cache the list of courses a user can access.
+        ("SUPERSET_COURSE_ACCESS_CACHE_TIMEOUT", 300),
+        # How long (in seconds) after expiring a cached course list may still be used,
+        # while it is refreshed in the background.
+        ("SUPERSET_COURSE_ACCESS_CACHE_STALE_TIMEOUT", 300),
+        # Course lists of recently active users are refreshed this many seconds before they expire.
+        ("SUPERSET_COURSE_ACCESS_REFRESH_AHEAD", 60),
+        # How long (in seconds) a user is considered active after their last request.
+        ("SUPERSET_COURSE_ACCESS_ACTIVE_TIMEOUT", 3600),
+        # Course lists longer than this are not cached.
+        ("SUPERSET_COURSE_ACCESS_CACHE_MAX_COURSES", 10_000),
+        # Number of users' course lists kept in each process's in-memory cache.
+        ("SUPERSET_COURSE_ACCESS_CACHE_L1_SIZE", 1000),
+        # Course filters for users with more than this many courses use
+        # SUPERSET_COURSE_FILTER_LARGE_STRATEGY instead of an inline IN list.
+        ("SUPERSET_COURSE_FILTER_INLINE_MAX", 100),
+        ("SUPERSET_COURSE_FILTER_LARGE_STRATEGY", "table"),
+        # The "table" strategy stores long course lists in this ClickHouse table, in the
+        # ClickHouse database SUPERSET_COURSE_ACCESS_TABLE_SCHEMA, through the Superset
+        # database with this name (e.g. the one the course data is queried from). Leave
+        # the database empty to filter long lists inline.
+        ("SUPERSET_COURSE_ACCESS_TABLE", "superset_course_access"),
+        ("SUPERSET_COURSE_ACCESS_TABLE_SCHEMA", "default"),
+        ("SUPERSET_COURSE_ACCESS_TABLE_DATABASE", ""),
+        ("SUPERSET_COURSE_ACCESS_TABLE_TTL_DAYS", 7),
         ("SUPERSET_ADMIN_EMAIL", "admin@openedx.org"),
+        # Caddy proxy: response encodings (e.g. "zstd gzip", or "" to disable), and the
+        # Cache-Control max-age of the content-hashed static assets (0 to leave it as is).
+        ("SUPERSET_PROXY_ENCODINGS", "zstd gzip"),
+        ("SUPERSET_PROXY_STATIC_MAX_AGE", 31536000),
+        # Cache the hashed static assets in Caddy itself. This requires a Caddy image
+        # built with the cache-handler module.
+        ("SUPERSET_PROXY_EDGE_CACHE", False),
+        ("SUPERSET_PROXY_EDGE_CACHE_TTL", "720h"),
+        # Gunicorn settings of the web app. The worker class is one of "sync", "gthread"
+        # or "gevent"; gevent serves many slow requests (e.g. long chart queries)
+        # concurrently in each worker.
+        ("SUPERSET_GUNICORN_WORKER_CLASS", "gthread"),
+        ("SUPERSET_GUNICORN_WORKERS", 2),
+        ("SUPERSET_GUNICORN_THREADS", 20),
+        ("SUPERSET_GUNICORN_WORKER_CONNECTIONS", 1000),
+        ("SUPERSET_GUNICORN_TIMEOUT", 120),
+        ("SUPERSET_GUNICORN_GRACEFUL_TIMEOUT", 30),
+        ("SUPERSET_GUNICORN_KEEPALIVE", 5),
+        ("SUPERSET_GUNICORN_MAX_REQUESTS", 1000),
+        ("SUPERSET_GUNICORN_MAX_REQUESTS_JITTER", 100),
+        ("SUPERSET_GUNICORN_PRELOAD", True),
+        # Kubernetes scaling of the web Deployment. With the HorizontalPodAutoscaler
+        # enabled, SUPERSET_REPLICAS is the minimum number of replicas.
+        ("SUPERSET_REPLICAS", 1),
+        (
+            "SUPERSET_RESOURCES",
+            {
+                "requests": {"cpu": "500m", "memory": "1Gi"},
+                "limits": {"memory": "2Gi"},
+            },
+        ),
+        ("SUPERSET_HPA_ENABLED", False),
+        ("SUPERSET_HPA_MAX_REPLICAS", 4),
+        ("SUPERSET_HPA_CPU_UTILIZATION", 75),
+        # Kubernetes scaling of each worker pool Deployment. A pool can override these
+        # with its own "replicas", "resources" and "hpa_max_replicas".
+        ("SUPERSET_WORKER_REPLICAS", 1),
+        (
+            "SUPERSET_WORKER_RESOURCES",
+            {
+                "requests": {"cpu": "250m", "memory": "1Gi"},
+                "limits": {"memory": "2Gi"},
+            },
+        ),
+        ("SUPERSET_WORKER_HPA_ENABLED", False),
+        ("SUPERSET_WORKER_HPA_MAX_REPLICAS", 4),
+        ("SUPERSET_WORKER_HPA_CPU_UTILIZATION", 75),
+        # Celery worker pools, one worker deployment each. "queues" is a comma-separated
+        # list of the queues consumed by the pool, and "autoscale" ("max,min"), when set,
+        # replaces the fixed "concurrency".
+        (
+            "SUPERSET_WORKER_POOLS",
+            {
+                "default": {
+                    "queues": "celery",
+                    "concurrency": 2,
+                    "autoscale": "",
+                    "prefetch_multiplier": 1,
+                    "max_tasks_per_child": 100,
+                },
+                "sql-lab": {
+                    "queues": "sql_lab",
+                    "concurrency": 2,
+                    "autoscale": "",
+                    "prefetch_multiplier": 1,
+                    "max_tasks_per_child": 20,
+                },
+                "reports": {
+                    "queues": "reports",
+                    "concurrency": 2,
+                    "autoscale": "",
+                    "prefetch_multiplier": 1,
+                    "max_tasks_per_child": 20,
+                },
+                "warmup": {
+                    "queues": "warmup",
+                    "concurrency": 2,
+                    "autoscale": "",
+                    "prefetch_multiplier": 1,
+                    "max_tasks_per_child": 100,
+                },
+            },
+        ),
+        # Celery task name patterns and the queue they are sent to. Every queue must be
+        # consumed by one of the SUPERSET_WORKER_POOLS. Other tasks go to "celery".
+        (
+            "SUPERSET_WORKER_ROUTES",
+            {
+                "sql_lab.*": "sql_lab",
+                "reports.*": "reports",
+                "cache-warmup": "warmup",
+                "openedx.warm_*": "warmup",
+            },
+        ),
+        # Streaming exports at /openedx/export/: "stream" them to the client, or write
+        # them to SUPERSET_EXPORT_DIR first ("file") to release ClickHouse sooner.
+        ("SUPERSET_EXPORT_MODE", "stream"),
+        ("SUPERSET_EXPORT_DIR", "/app/superset_home/exports"),
+        ("SUPERSET_EXPORT_CHUNK_SIZE", 10000),
+        ("SUPERSET_EXPORT_MAX_ROWS", 0),
+        # Dashboard cache warm-up: list of dashboard ids or slugs to refresh on the
+        # SUPERSET_CACHE_WARMUP_SCHEDULE crontab ("minute hour day-of-month month day-of-week").
+        ("SUPERSET_CACHE_WARMUP_DASHBOARDS", []),
+        ("SUPERSET_CACHE_WARMUP_SCHEDULE", "0 6 * * *"),
+        # Users to warm the dashboards for, e.g. one global staff user for Admin and Alpha.
+        ("SUPERSET_CACHE_WARMUP_USERNAMES", []),
+        # Also warm the dashboards for this many of the most recently active users.
+        ("SUPERSET_CACHE_WARMUP_MAX_ACTIVE_USERS", 20),
+        ("SUPERSET_CACHE_WARMUP_CONCURRENCY", 2),
+        # Cache tiers: each one can have its own Redis host and DB, default timeout (in seconds)
+        # and key prefix. Redis evicts keys across all the DBs of a host, so large chart data
+        # can only be kept from evicting other cached values by moving it to a separate host.
+        # On the same host, each tier needs its own DB: DBs 0 and 1 are the Celery brokers'
+        # and the Open edX cache's, and DB 4 is SUPERSET_GLOBAL_ASYNC_QUERIES_REDIS_DB.
+        # Superset metadata, and the Open edX course access cache
+        ("SUPERSET_CACHE_METADATA_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_CACHE_METADATA_REDIS_DB", 5),
+        ("SUPERSET_CACHE_METADATA_TIMEOUT", 300),
+        ("SUPERSET_CACHE_METADATA_KEY_PREFIX", "superset_"),
+        # Size of the in-process LRU cache in front of Redis; set to 0 to disable.
+        ("SUPERSET_CACHE_METADATA_L1_SIZE", 1000),
+        ("SUPERSET_CACHE_METADATA_L1_TIMEOUT", 30),
+        # Chart data
+        ("SUPERSET_CACHE_DATA_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_CACHE_DATA_REDIS_DB", 2),
+        ("SUPERSET_CACHE_DATA_TIMEOUT", 3600),
+        ("SUPERSET_CACHE_DATA_KEY_PREFIX", "superset_data_"),
+        # "arrow" stores chart DataFrames as Arrow IPC, compressed with
+        # SUPERSET_CACHE_DATA_ARROW_COMPRESSION ("zstd", "lz4" or ""); "pickle" stores them as-is.
+        ("SUPERSET_CACHE_DATA_CODEC", "arrow"),
+        ("SUPERSET_CACHE_DATA_ARROW_COMPRESSION", "zstd"),
+        # Chart data larger than this many bytes is zlib-compressed; set to 0 to disable.
+        # Not needed when the Arrow codec already compresses the data.
+        ("SUPERSET_CACHE_DATA_COMPRESSION_MIN_SIZE", 0),
+        # Dashboard filter state
+        ("SUPERSET_CACHE_FILTER_STATE_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_CACHE_FILTER_STATE_REDIS_DB", 3),
+        ("SUPERSET_CACHE_FILTER_STATE_TIMEOUT", 90 * 24 * 3600),
+        ("SUPERSET_CACHE_FILTER_STATE_KEY_PREFIX", "superset_filter_state_"),
+        # Explore form data state
+        ("SUPERSET_CACHE_EXPLORE_FORM_DATA_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_CACHE_EXPLORE_FORM_DATA_REDIS_DB", 6),
+        ("SUPERSET_CACHE_EXPLORE_FORM_DATA_TIMEOUT", 7 * 24 * 3600),
+        ("SUPERSET_CACHE_EXPLORE_FORM_DATA_KEY_PREFIX", "superset_explore_form_data_"),
+        # SQL Lab and async query results, and Celery task results
+        ("SUPERSET_CACHE_RESULTS_REDIS_HOST", "{{ REDIS_HOST }}"),
+        ("SUPERSET_CACHE_RESULTS_REDIS_DB", 7),
+        ("SUPERSET_CACHE_RESULTS_TIMEOUT", 24 * 3600),
+        ("SUPERSET_CACHE_RESULTS_KEY_PREFIX", "superset_results"),
         # Set to 0 to have no row limit.
         ("SUPERSET_ROW_LIMIT", 100_000),
         ("SUPERSET_SENTRY_DSN", ""),
+        # Set a StatsD host to export metrics, including the Open edX login and access metrics.
+        ("SUPERSET_METRICS_STATSD_HOST", ""),
+        ("SUPERSET_METRICS_STATSD_PORT", 8125),
+        ("SUPERSET_METRICS_STATSD_PREFIX", "superset"),
         # List of dicts
         # [{
         #    "path": "path-in-the-superset-pod",
@@ -58,8 +314,13 @@ hooks.Filters.CONFIG_UNIQUE.add_items(
         ("SUPERSET_DB_PASSWORD", "{{ 24|random_string }}"),
         ("SUPERSET_OAUTH2_CLIENT_ID", "{{ 16|random_string }}"),
         ("SUPERSET_OAUTH2_CLIENT_SECRET", "{{ 16|random_string }}"),
+        # Client credentials of the global staff "superset-service" Open edX user
+        ("SUPERSET_OPENEDX_SERVICE_CLIENT_ID", "{{ 16|random_string }}"),
+        ("SUPERSET_OPENEDX_SERVICE_CLIENT_SECRET", "{{ 16|random_string }}"),
         ("SUPERSET_ADMIN_USERNAME", "{{ 12|random_string }}"),
         ("SUPERSET_ADMIN_PASSWORD", "{{ 24|random_string }}"),
+        # Must be at least 32 bytes long
+        ("SUPERSET_GLOBAL_ASYNC_QUERIES_JWT_SECRET", "{{ 40|random_string }}"),
         ("RUN_SUPERSET", True),
         (
             "SUPERSET_TALISMAN_CONFIG",
@@ -109,39 +370,106 @@ MY_INIT_TASKS = [
     ("lms", ("superset", "jobs", "init", "init-openedx.sh")),
 ]
 
+
 # For each task added to MY_INIT_TASKS, we load the task template
 # and add it to the CLI_DO_INIT_TASKS filter, which tells Tutor to
-# run it as part of the `init` job.
-for service, template_path in MY_INIT_TASKS:
-    full_path: str = pkg_resources.resource_filename(
-        "tutorsuperset", os.path.join("templates", *template_path)
+# run it as part of the `init` job. The templates are only read when
+# Tutor applies the filter, so other commands don't pay for it.
+@hooks.Filters.CLI_DO_INIT_TASKS.add()
+def _add_init_tasks(init_tasks: t.List[t.Tuple[str, str]]) -> t.List[t.Tuple[str, str]]:
+    for service, template_path in MY_INIT_TASKS:
+        init_task = PACKAGE_ROOT.joinpath("templates", *template_path)
+        init_tasks.append((service, init_task.read_text(encoding="utf-8")))
+    return init_tasks
+
+
+########################################
+# CUSTOM JOBS
+########################################
+
+
+@click.command(
+    name="superset-warm-access",
+    help=(
+        "Pre-populate the course access cache of the users who recently logged into "
+        "Superset, with the courses listed by the LMS to the superset-service user."
+    ),
+)
+@click.option(
+    "--days",
+    default=30,
+    show_default=True,
+    help="Warm the users who logged in during the last N days.",
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    show_default=True,
+    help="Number of users to warm in parallel.",
+)
+@click.option(
+    "--rate",
+    default=10.0,
+    show_default=True,
+    help="Maximum number of users warmed per second, to spare the LMS.",
+)
+def warm_access(
+    days: int, concurrency: int, rate: float
+) -> t.Iterable[t.Tuple[str, str]]:
+    yield (
+        "superset",
+        "/usr/bin/env bash /app/docker/docker-bootstrap.sh\n"
+        "python /app/pythonpath/openedx_warm_access.py "
+        f"--days {days} --concurrency {concurrency} --rate {rate}",
     )
-    with open(full_path, encoding="utf-8") as init_task_file:
-        init_task: str = init_task_file.read()
-    hooks.Filters.CLI_DO_INIT_TASKS.add_item((service, init_task))
+
+
+hooks.Filters.CLI_DO_COMMANDS.add_item(warm_access)
 
 
 ########################################
 # DOCKER IMAGE MANAGEMENT
 ########################################
 
-# To build an image with `tutor images build myimage`, add a Dockerfile to templates/superset/build/myimage and write:
-# hooks.Filters.IMAGES_BUILD.add_item((
-#     "myimage",
-#     ("plugins", "superset", "build", "myimage"),
-#     "docker.io/myimage:{{ SUPERSET_VERSION }}",
-#     (),
-# )
-
-# To pull/push an image with `tutor images pull myimage` and `tutor images push myimage`, write:
-# hooks.Filters.IMAGES_PULL.add_item((
-#     "myimage",
-#     "docker.io/myimage:{{ SUPERSET_VERSION }}",
-# )
-# hooks.Filters.IMAGES_PUSH.add_item((
-#     "myimage",
-#     "docker.io/myimage:{{ SUPERSET_VERSION }}",
-# )
+UPSTREAM_DOCKER_IMAGE = "apache/superset:{{ SUPERSET_TAG }}"
+
+
+def _builds_docker_image(config: Config) -> bool:
+    """
+    The Superset image is only built, and pushed, once SUPERSET_DOCKER_IMAGE is set to
+    another image than the upstream one.
+    """
+    image = env.render_str(config, str(config["SUPERSET_DOCKER_IMAGE"]))
+    return image != env.render_str(config, UPSTREAM_DOCKER_IMAGE)
+
+
+@hooks.Filters.IMAGES_BUILD.add()
+def _add_image_to_build(
+    build_images: t.List[t.Tuple[str, t.Tuple[str, ...], str, t.Tuple[str, ...]]],
+    config: Config,
+) -> t.List[t.Tuple[str, t.Tuple[str, ...], str, t.Tuple[str, ...]]]:
+    if _builds_docker_image(config):
+        build_images.append(
+            (
+                "superset",
+                ("plugins", "superset", "build", "superset"),
+                "{{ SUPERSET_DOCKER_IMAGE }}",
+                (),
+            )
+        )
+    return build_images
+
+
+@hooks.Filters.IMAGES_PUSH.add()
+def _add_image_to_push(
+    remote_images: t.List[t.Tuple[str, str]], config: Config
+) -> t.List[t.Tuple[str, str]]:
+    if _builds_docker_image(config):
+        remote_images.append(("superset", "{{ SUPERSET_DOCKER_IMAGE }}"))
+    return remote_images
+
+
+hooks.Filters.IMAGES_PULL.add_item(("superset", "{{ SUPERSET_DOCKER_IMAGE }}"))
 
 
 ########################################
@@ -153,7 +481,7 @@ for service, template_path in MY_INIT_TASKS:
 hooks.Filters.ENV_TEMPLATE_ROOTS.add_items(
     # Root paths for template files, relative to the project root.
     [
-        pkg_resources.resource_filename("tutorsuperset", "templates"),
+        str(PACKAGE_ROOT.joinpath("templates")),
     ]
 )
 
@@ -175,13 +503,19 @@ hooks.Filters.ENV_TEMPLATE_TARGETS.add_items(
 #  this section as-is :)
 ########################################
 
+
 # For each file in tutorsuperset/patches,
 # apply a patch based on the file's name and contents.
-for path in glob(
-    os.path.join(
-        pkg_resources.resource_filename("tutorsuperset", "patches"),
-        "*",
-    )
-):
-    with open(path, encoding="utf-8") as patch_file:
-        hooks.Filters.ENV_PATCHES.add_item((os.path.basename(path), patch_file.read()))
+# Tutor reads every ENV_PATCHES item once plugins are loaded, so each patch is instead
+# added to its own ENV_PATCH filter: the file is only read when that patch is rendered.
+def _add_patch(patch: t.Any) -> None:
+    def _add_patch_content(contents: t.List[str]) -> t.List[str]:
+        contents.append(patch.read_text(encoding="utf-8"))
+        return contents
+
+    hooks.Filters.ENV_PATCH(patch.name).add()(_add_patch_content)
+
+
+for _patch in PACKAGE_ROOT.joinpath("patches").iterdir():
+    if _patch.is_file() and not _patch.name.startswith("."):
+        _add_patch(_patch)
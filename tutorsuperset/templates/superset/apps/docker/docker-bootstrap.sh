@@ -23,6 +23,8 @@
 set -eo pipefail
 
 REQUIREMENTS_LOCAL="/app/docker/requirements-local.txt"
+# Written by the tutor-contrib-superset image build, cf build/superset/Dockerfile
+REQUIREMENTS_BAKED_SHA256="/app/requirements-baked.sha256"
 # If Cypress run – overwrite the password for admin and export env variables
 if [ "$CYPRESS_CONFIG" == "true" ]; then
     export SUPERSET_CONFIG=tests.integration_tests.superset_test_config
@@ -32,7 +34,10 @@ fi
 #
 # Make sure we have dev requirements installed
 #
-if [ -f "${REQUIREMENTS_LOCAL}" ]; then
+if [ -f "${REQUIREMENTS_LOCAL}" ] && [ -f "${REQUIREMENTS_BAKED_SHA256}" ] \
+    && [ "$(sha256sum "${REQUIREMENTS_LOCAL}" | cut -d " " -f 1)" == "$(cat "${REQUIREMENTS_BAKED_SHA256}")" ]; then
+  echo "Local overrides at ${REQUIREMENTS_LOCAL} are already installed in the image"
+elif [ -f "${REQUIREMENTS_LOCAL}" ]; then
   echo "Installing local overrides at ${REQUIREMENTS_LOCAL}"
   pip install -r "${REQUIREMENTS_LOCAL}"
 else
@@ -41,7 +46,8 @@ fi
 
 if [[ "${1}" == "worker" ]]; then
   echo "Starting Celery worker..."
-  celery --app=superset.tasks.celery_app:app worker -Ofair -l INFO
+  # Extra arguments, e.g. --queues and --concurrency, are passed on to the worker
+  celery --app=superset.tasks.celery_app:app worker -Ofair -l INFO "${@:2}"
 elif [[ "${1}" == "beat" ]]; then
   echo "Starting Celery beat..."
   celery --app=superset.tasks.celery_app:app beat --pidfile /tmp/celerybeat.pid -l INFO -s "${SUPERSET_HOME}"/celerybeat-schedule
@@ -50,5 +56,5 @@ elif [[ "${1}" == "app" ]]; then
   flask run -p 8088 --with-threads --reload --debugger --host=0.0.0.0
 elif [[ "${1}" == "app-gunicorn" ]]; then
   echo "Starting web app..."
-  /usr/bin/run-server.sh
+  gunicorn --config /app/docker/gunicorn_config.py
 fi
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for the Superset web app, used by `docker-bootstrap.sh app-gunicorn`.
+
+Based on the defaults of the image's /usr/bin/run-server.sh.
+"""
+bind = "0.0.0.0:{{ SUPERSET_PORT }}"
+wsgi_app = "superset.app:create_app()"
+
+worker_class = "{{ SUPERSET_GUNICORN_WORKER_CLASS }}"
+workers = int({{ SUPERSET_GUNICORN_WORKERS }})
+# Only used by the gthread worker class
+threads = int({{ SUPERSET_GUNICORN_THREADS }})
+# Only used by the gevent and eventlet worker classes
+worker_connections = int({{ SUPERSET_GUNICORN_WORKER_CONNECTIONS }})
+
+timeout = int({{ SUPERSET_GUNICORN_TIMEOUT }})
+graceful_timeout = int({{ SUPERSET_GUNICORN_GRACEFUL_TIMEOUT }})
+keepalive = int({{ SUPERSET_GUNICORN_KEEPALIVE }})
+
+# Recycle workers after this many requests (0 to never recycle), to bound memory growth
+max_requests = int({{ SUPERSET_GUNICORN_MAX_REQUESTS }})
+max_requests_jitter = int({{ SUPERSET_GUNICORN_MAX_REQUESTS_JITTER }})
+
+# Load the app once in the master before forking the workers: they start faster and
+# share the app's memory pages until they write to them.
+preload_app = {{ SUPERSET_GUNICORN_PRELOAD }}
+
+limit_request_line = 0
+limit_request_field_size = 0
+accesslog = "-"
+errorlog = "-"
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """
+    Closes the master's database connections, so that workers never share them.
+    """
+    if not server.cfg.preload_app:
+        return
+
+    from superset import db  # pylint: disable=import-outside-toplevel
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose()
@@ -0,0 +1,115 @@
+"""
+Client helpers for the Open edX REST APIs.
+
+All requests share one pooled, keep-alive HTTP session per process.
+"""
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_WORKERS = 4
+
+_http_session = None
+
+
+def get_http_session(pool_maxsize=10):
+    """
+    Returns the process-wide HTTP session, creating it if needed.
+    """
+    global _http_session  # pylint: disable=global-statement
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+    return _http_session
+
+
+def fetch_json(url, headers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    GETs the given URL and returns the decoded JSON response.
+
+    Raises requests.RequestException if the request fails.
+    """
+    response = get_http_session().get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def post_form(url, data, headers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    POSTs the given form data to the URL and returns the decoded JSON response.
+
+    Raises requests.RequestException if the request fails.
+    """
+    response = get_http_session().post(url, data=data, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def page_url(url, page):
+    """
+    Returns the given URL with its "page" query parameter set to page.
+    """
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "page"]
+    query.append(("page", str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _num_pages(response):
+    """
+    Returns the total number of pages reported by a paginated response, or None if unknown.
+
+    Handles both the flat DRF pagination and the namespaced pagination used by the courses API.
+    """
+    pagination = response.get("pagination", response)
+    if pagination.get("num_pages"):
+        return int(pagination["num_pages"])
+    count = pagination.get("count")
+    page_size = len(response.get("results", []))
+    if count is not None and page_size:
+        return math.ceil(int(count) / page_size)
+    return None
+
+
+def _next_url(response):
+    return response.get("pagination", response).get("next")
+
+
+def iter_paginated_results(fetch_page, url, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Yields every result from a paginated Open edX API, in order.
+
+    fetch_page(url) must return the decoded JSON of one page. The first page
+    gives the total number of pages, and the remaining pages are then fetched
+    concurrently by up to max_workers threads. If the API does not report its
+    page count, the "next" links are followed one page at a time.
+    """
+    response = fetch_page(url)
+    yield from response.get("results", [])
+
+    if not _next_url(response):
+        return
+
+    num_pages = _num_pages(response)
+    if num_pages is None:
+        next_url = _next_url(response)
+        while next_url:
+            response = fetch_page(next_url)
+            yield from response.get("results", [])
+            next_url = _next_url(response)
+        return
+
+    urls = [page_url(url, page) for page in range(2, num_pages + 1)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        for response in executor.map(fetch_page, urls):
+            yield from response.get("results", [])
@@ -0,0 +1,568 @@
+"""
+Caches and request deduplication used by the Open edX integration.
+
+The course access cache is shared by all the Superset processes through Redis,
+with a small in-process LRU layer in front of it to spare the round-trip to Redis.
+TieredRedisCache brings the same layering, plus compression, to Superset's own caches.
+"""
+import json
+import logging
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+from flask_caching.backends.rediscache import RedisCache as FlaskRedisCache
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded in-process cache with per-entry expiry.
+    """
+
+    def __init__(self, max_size=1024, timeout=300):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value stored for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Stores value for key, evicting the least recently used entries if full.
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CourseAccessCache:
+    """
+    Two-level cache of the course IDs a user can access, keyed by (username, permission).
+
+    L1 is a short-lived in-process LRUCache; L2 is a cachelib backend (Redis) shared
+    by every worker and pod. Course lists longer than max_entry_size are not cached.
+
+    Entries are fresh for `timeout` seconds, then may still be served as stale for
+    `stale_timeout` seconds while they are refreshed in the background.
+
+    The cache also records which users were recently active, so that the refresher task
+    can renew their entries before they expire. This registry is kept in Redis through
+    the `redis` client: each user has their own key, which expires `active_timeout`
+    seconds after they were last seen, and an `active_users` sorted set indexes the keys
+    by that time. It only holds usernames and permissions: the refresher fetches the
+    courses with a service access token, never with the users' own tokens.
+    """
+
+    ACTIVE_USERS_KEY = "active_users"
+    REFRESH_LOCK_TIMEOUT = 60
+
+    def __init__(
+        self,
+        backend=None,
+        redis=None,
+        key_prefix="",
+        timeout=300,
+        stale_timeout=0,
+        refresh_ahead=60,
+        active_timeout=3600,
+        max_entry_size=10_000,
+        l1_size=1024,
+        l1_timeout=60,
+    ):
+        self.backend = backend
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.refresh_ahead = refresh_ahead
+        self.active_timeout = active_timeout
+        self.max_entry_size = max_entry_size
+        self.l1 = LRUCache(max_size=l1_size, timeout=min(l1_timeout, timeout))
+        self._touched = LRUCache(max_size=l1_size, timeout=refresh_ahead)
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    @staticmethod
+    def make_key(username, permission):
+        return f"{permission}:{username}"
+
+    def _get_entry(self, key):
+        """
+        Returns the cached (fetched_at, courses) entry for key, or None on a cache miss.
+        """
+        entry = self.l1.get(key)
+        if entry is not None:
+            self.l1_hits += 1
+            return entry
+
+        if self.backend is not None:
+            try:
+                entry = self.backend.get(key)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Unable to read course access cache for %s", key)
+                entry = None
+            if entry is not None:
+                self.l2_hits += 1
+                self.l1.set(key, entry)
+                return entry
+
+        self.misses += 1
+        return None
+
+    def get(self, username, permission):
+        """
+        Returns a (courses, is_stale) tuple, or (None, False) on a cache miss.
+        """
+        entry = self._get_entry(self.make_key(username, permission))
+        if entry is None:
+            return None, False
+
+        fetched_at, courses = entry
+        is_stale = time.time() - fetched_at > self.timeout
+        if is_stale:
+            self.stale_hits += 1
+        return courses, is_stale
+
+    def get_age(self, username, permission):
+        """
+        Returns how many seconds ago the cached entry was fetched, or None if there is none.
+        """
+        entry = self._get_entry(self.make_key(username, permission))
+        if entry is None:
+            return None
+        return time.time() - entry[0]
+
+    def set(self, username, permission, courses):
+        """
+        Stores the list of course IDs for the given user and permission.
+        """
+        if len(courses) > self.max_entry_size:
+            log.warning(
+                "Not caching %d courses for %s: exceeds max_entry_size=%d",
+                len(courses), username, self.max_entry_size,
+            )
+            return
+
+        key = self.make_key(username, permission)
+        entry = (time.time(), list(courses))
+        self.l1.set(key, entry)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, entry, timeout=self.timeout + self.stale_timeout)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Unable to write course access cache for %s", key)
+
+    def delete(self, username, permission):
+        key = self.make_key(username, permission)
+        self.l1.delete(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def claim_refresh(self, username, permission):
+        """
+        Returns True if the caller should refresh this entry, i.e. nobody else is refreshing it.
+        """
+        if self.backend is None:
+            return True
+        lock_key = f"refreshing:{self.make_key(username, permission)}"
+        return bool(self.backend.add(lock_key, 1, timeout=self.REFRESH_LOCK_TIMEOUT))
+
+    def touch(self, username, permission):
+        """
+        Records that the given user is active.
+
+        The record expires after `active_timeout` seconds. Writes to Redis at most once
+        every `refresh_ahead` seconds per process.
+        """
+        key = self.make_key(username, permission)
+        if self.redis is None or self._touched.get(key):
+            return
+        self._touched.set(key, True)
+
+        now = time.time()
+        record = {"username": username, "permission": permission, "last_seen": now}
+        index_key = self.key_prefix + self.ACTIVE_USERS_KEY
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.set(self._active_user_key(key), json.dumps(record), ex=self.active_timeout)
+            pipeline.zadd(index_key, {key: now})
+            pipeline.zremrangebyscore(index_key, "-inf", now - self.active_timeout)
+            pipeline.expire(index_key, self.active_timeout)
+            pipeline.execute()
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Unable to record active user %s", key)
+
+    def _active_user_key(self, key):
+        return f"{self.key_prefix}active_user:{key}"
+
+    def active_users(self):
+        """
+        Returns the users seen in the last `active_timeout` seconds.
+        """
+        if self.redis is None:
+            return []
+        keys = self.redis.zrangebyscore(
+            self.key_prefix + self.ACTIVE_USERS_KEY, time.time() - self.active_timeout, "+inf"
+        )
+        if not keys:
+            return []
+        records = self.redis.mget(
+            [self._active_user_key(key.decode() if isinstance(key, bytes) else key) for key in keys]
+        )
+        return [json.loads(record) for record in records if record is not None]
+
+    def needs_refresh(self, username, permission):
+        """
+        Returns True if the entry is missing or will expire within `refresh_ahead` seconds.
+        """
+        age = self.get_age(username, permission)
+        return age is None or age >= self.timeout - self.refresh_ahead
+
+    def stats(self):
+        """
+        Returns the hit/miss counters for this process.
+        """
+        hits = self.l1_hits + self.l2_hits
+        total = hits + self.misses
+        return {
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "l1_size": len(self.l1),
+        }
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls for the same key: one caller runs the function,
+    and the others wait for it and share its result.
+
+    Within a process, callers wait on a threading.Event. Across processes, the
+    caller running the function holds an add() lock in the backend (Redis), and
+    stores its result there for `result_timeout` seconds for the others to pick up.
+    Results which must not be stored in the backend, e.g. secrets, are only shared
+    within the process: callers in other processes only share the lock, and learn that
+    the call was made.
+    """
+
+    def __init__(self, backend=None, lock_timeout=30, result_timeout=10, poll_interval=0.1):
+        self.backend = backend
+        self.lock_timeout = lock_timeout
+        self.result_timeout = result_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, waited=None):
+        """
+        Returns fn(), or the result of the call to fn already in flight for key.
+
+        If `waited` is given, the result of fn is not stored in the backend: callers which
+        waited for the call in another process, or came within `result_timeout` seconds
+        after it, return waited() instead.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn, waited)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _do_shared(self, key, fn, waited=None):
+        """
+        Runs fn() unless another process is already running it, in which case waits for its result.
+        """
+        if self.backend is None:
+            return fn()
+
+        lock_key = f"lock:{key}"
+        result_key = f"result:{key}"
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            shared = self.backend.get(result_key)
+            if shared is not None:
+                return shared[0] if waited is None else waited()
+            if self.backend.add(lock_key, 1, timeout=self.lock_timeout):
+                break
+            if time.monotonic() > deadline:
+                if waited is not None:
+                    log.warning("Timed out waiting for %s", key)
+                    return waited()
+                log.warning("Timed out waiting for %s, running it anyway", key)
+                return fn()
+            time.sleep(self.poll_interval)
+
+        try:
+            result = fn()
+            # Wrapped in a tuple, so that a None result can be shared too. Results which
+            # can't be shared only leave a marker that the call was made.
+            shared = (result,) if waited is None else ()
+            self.backend.set(result_key, shared, timeout=self.result_timeout)
+            return result
+        finally:
+            self.backend.delete(lock_key)
+
+
+class ArrowFrame:
+    """
+    A pandas DataFrame serialized as an Arrow IPC stream, which pickles much smaller
+    and faster than the DataFrame itself.
+
+    The DataFrame's dtypes are kept alongside, since the conversion back from Arrow may
+    pick other ones, e.g. "str" for object columns of strings with pandas 3.
+    """
+
+    __slots__ = ("data", "dtypes")
+
+    def __init__(self, data, dtypes=None):
+        self.data = data
+        self.dtypes = dtypes
+
+    def __getstate__(self):
+        return self.data, self.dtypes
+
+    def __setstate__(self, state):
+        # Entries stored before the dtypes were kept only hold the data
+        self.data, self.dtypes = state if isinstance(state, tuple) else (state, None)
+
+    @classmethod
+    def from_pandas(cls, df, compression=None):
+        table = pa.Table.from_pandas(df)
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return cls(sink.getvalue().to_pybytes(), list(df.dtypes))
+
+    def to_pandas(self):
+        # Reading from the buffer is zero-copy: only the conversion to pandas copies the data.
+        df = pa.ipc.open_stream(pa.py_buffer(self.data)).read_all().to_pandas()
+        for position, dtype in enumerate(self.dtypes or []):
+            column = df.columns[position]
+            if df.dtypes.iloc[position] != dtype:
+                df[column] = df[column].astype(dtype)
+        return df
+
+
+class TieredRedisCache(FlaskRedisCache):
+    """
+    flask-caching Redis backend, with optional columnar codec, compression and in-process LRU layer.
+
+    Use it as the CACHE_TYPE of a Superset cache config, and set its options in CACHE_OPTIONS:
+
+    * codec: "arrow" stores the DataFrames found in cached values (e.g. the "df" of
+      chart data payloads) as Arrow IPC streams, compressed with `arrow_compression`
+      ("zstd", "lz4" or None). "pickle" stores them as-is.
+    * compression_min_size: values which pickle to at least this many bytes are
+      zlib-compressed before being stored in Redis. 0 disables compression.
+    * l1_size: number of values kept in each process's LRUCache in front of Redis,
+      for `l1_timeout` seconds. Values deleted or changed by other processes may be
+      served from L1 until then, so this is only meant for small metadata caches.
+      0 disables the L1 layer.
+
+    Values are serialized by this class rather than by flask-caching, whose hooks differ
+    between versions. L1 holds the serialized values, so every read returns a new
+    object, which callers may change without affecting the cached value.
+    """
+
+    # Single-byte prefixes of the stored values, which integers never start with
+    PICKLE_MARKER = b"!"
+    COMPRESSED_MARKER = b"z"
+
+    def __init__(
+        self,
+        *args,
+        codec="pickle",
+        arrow_compression="zstd",
+        compression_min_size=0,
+        compression_level=6,
+        l1_size=0,
+        l1_timeout=30,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.codec = codec
+        self.arrow_compression = arrow_compression
+        self.compression_min_size = compression_min_size
+        self.compression_level = compression_level
+        self.l1 = LRUCache(max_size=l1_size, timeout=l1_timeout) if l1_size else None
+
+    def _encode_frame(self, value):
+        if isinstance(value, pd.DataFrame):
+            try:
+                return ArrowFrame.from_pandas(value, compression=self.arrow_compression)
+            except (pa.ArrowException, ValueError, TypeError):
+                # e.g. mixed-type object columns: pickle the DataFrame as-is
+                log.debug("Unable to encode DataFrame as Arrow", exc_info=True)
+        return value
+
+    @staticmethod
+    def _decode_frame(value):
+        if isinstance(value, ArrowFrame):
+            return value.to_pandas()
+        return value
+
+    def dump_object(self, value):
+        # Integers are stored as such, so that inc() and dec() work
+        if type(value) == int:  # pylint: disable=unidiomatic-typecheck
+            return str(value).encode("ascii")
+
+        if self.codec == "arrow":
+            if isinstance(value, dict):
+                value = {key: self._encode_frame(item) for key, item in value.items()}
+            else:
+                value = self._encode_frame(value)
+
+        data = self.PICKLE_MARKER + pickle.dumps(value)
+        if self.compression_min_size and len(data) >= self.compression_min_size:
+            return self.COMPRESSED_MARKER + zlib.compress(data, self.compression_level)
+        return data
+
+    def load_object(self, value):
+        if value is None:
+            return None
+        if value.startswith(self.COMPRESSED_MARKER):
+            value = zlib.decompress(value[1:])
+        if not value.startswith(self.PICKLE_MARKER):
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        value = pickle.loads(value[1:])
+
+        # Decoded whatever the current codec, so that entries stored before a change still load
+        if isinstance(value, dict):
+            return {key: self._decode_frame(item) for key, item in value.items()}
+        return self._decode_frame(value)
+
+    def _redis_key(self, key):
+        return f"{self._get_prefix()}{key}"
+
+    def _get_data(self, keys):
+        """
+        Returns the serialized values of the keys, from L1 or else from Redis.
+        """
+        data = [self.l1.get(key) for key in keys] if self.l1 is not None else [None] * len(keys)
+        missing = [position for position, item in enumerate(data) if item is None]
+        if missing:
+            fetched = self._write_client.mget([self._redis_key(keys[i]) for i in missing])
+            for position, item in zip(missing, fetched):
+                data[position] = item
+                if item is not None and self.l1 is not None:
+                    self.l1.set(keys[position], item)
+        return data
+
+    def get(self, key):
+        return self.load_object(self._get_data([key])[0])
+
+    def get_many(self, *keys):
+        return [self.load_object(item) for item in self._get_data(keys)]
+
+    def set(self, key, value, timeout=None):
+        return self.set_many({key: value}, timeout=timeout) == [key]
+
+    def set_many(self, mapping, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        data = {key: self.dump_object(value) for key, value in mapping.items()}
+        pipeline = self._write_client.pipeline(transaction=False)
+        for key, item in data.items():
+            pipeline.set(
+                name=self._redis_key(key), value=item, ex=None if timeout == -1 else timeout
+            )
+        results = pipeline.execute()
+        if self.l1 is not None:
+            for key, item in data.items():
+                self.l1.set(key, item)
+        return [key for key, was_set in zip(data, results) if was_set]
+
+    def add(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        item = self.dump_object(value)
+        added = self._write_client.set(
+            name=self._redis_key(key), value=item, nx=True, ex=None if timeout == -1 else timeout
+        )
+        if added and self.l1 is not None:
+            self.l1.set(key, item)
+        return bool(added)
+
+    def delete(self, key):
+        return self.delete_many(key) == [key]
+
+    def delete_many(self, *keys):
+        if not keys:
+            return []
+        if self.l1 is not None:
+            for key in keys:
+                self.l1.delete(key)
+        self._write_client.delete(*[self._redis_key(key) for key in keys])
+        return list(keys)
+
+    def clear(self):
+        if self.l1 is not None:
+            self.l1.clear()
+        return super().clear()
@@ -0,0 +1,330 @@
+"""
+Connection management for the analytics data sources.
+
+Superset connects to its data sources without a connection pool, so each ClickHouse
+query would otherwise open new HTTP connections. Instead, all ClickHouse connections
+share one bounded urllib3 pool per process, passed to clickhouse-connect as `pool_mgr`.
+
+The query governor also applies per-role limits to ClickHouse queries (cf QUERY_GOVERNOR):
+ClickHouse settings such as max_execution_time, max_memory_usage and priority, and a
+maximum number of concurrent queries per user. The latter is enforced across all Superset
+processes by QuerySlots in Redis, taken by the engine's SQLAlchemy pool when a connection
+is checked out, in front of the shared pool.
+
+Large course lists are stored in the ClickHouse COURSE_ACCESS_TABLE when they are fetched
+(cf write_course_access), so that course filters can refer to them instead of listing
+every course.
+"""
+import hashlib
+import logging
+import time
+import uuid
+
+import urllib3
+from flask import current_app, g, has_app_context
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from openedx_cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+CLICKHOUSE_DRIVERS = ("clickhouse", "clickhousedb")
+# clickhouse-connect, whose DB API connections accept pool_mgr and settings, unlike
+# clickhouse-sqlalchemy's ("clickhouse")
+CLICKHOUSE_CONNECT_DRIVER = "clickhousedb"
+
+_clickhouse_pool_manager = None
+_user_pool_classes = LRUCache(max_size=1000, timeout=3600)
+_course_access_table_created = False
+_written_access_keys = LRUCache(max_size=10_000, timeout=3600)
+
+
+def get_clickhouse_pool_manager():
+    """
+    Returns the process-wide ClickHouse HTTP connection pool, creating it if needed.
+
+    Once CLICKHOUSE_POOL_MAXSIZE connections to a server are in use, further queries wait
+    for one to be released rather than opening more.
+    """
+    global _clickhouse_pool_manager  # pylint: disable=global-statement
+    if _clickhouse_pool_manager is None:
+        config = current_app.config
+        _clickhouse_pool_manager = urllib3.PoolManager(
+            num_pools=config["CLICKHOUSE_POOL_NUM_POOLS"],
+            maxsize=config["CLICKHOUSE_POOL_MAXSIZE"],
+            block=True,
+        )
+    return _clickhouse_pool_manager
+
+
+class QuerySlots:
+    """
+    Bounds the number of concurrent queries of each user, across all Superset processes.
+
+    The slots a user holds are a Redis sorted set of slot IDs, scored by the time they
+    were taken. Slots are released when their query's connection is returned, and
+    expire after `timeout` seconds otherwise, so that the slots of a crashed process are
+    not held forever.
+    """
+
+    def __init__(self, redis, key_prefix="query_slots:", timeout=900, poll_interval=0.05):
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def acquire(self, username, max_slots, wait=0):
+        """
+        Takes one of the user's max_slots slots, waiting up to `wait` seconds for one to be
+        released.
+
+        Returns the ID of the slot, or None if the user's slots are all taken. Queries are
+        not bounded while Redis is unavailable.
+        """
+        key = self.key_prefix + username
+        slot = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+
+        def take_slot(pipeline):
+            now = time.time()
+            pipeline.zremrangebyscore(key, "-inf", now - self.timeout)
+            if pipeline.zcard(key) >= max_slots:
+                return False
+            pipeline.multi()
+            pipeline.zadd(key, {slot: now})
+            pipeline.expire(key, self.timeout)
+            return True
+
+        try:
+            while not self.redis.transaction(take_slot, key, value_from_callable=True):
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(self.poll_interval)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Unable to take a query slot for %s", username)
+        return slot
+
+    def release(self, username, slot):
+        """
+        Releases the given slot of the user.
+        """
+        try:
+            self.redis.zrem(self.key_prefix + username, slot)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Unable to release the query slot of %s", username)
+
+    def count(self, username):
+        """
+        Returns the number of slots the user holds.
+        """
+        return self.redis.zcount(self.key_prefix + username, time.time() - self.timeout, "+inf")
+
+
+def get_user_pool_class(poolclass, username, max_concurrent_queries):
+    """
+    Returns a subclass of the SQLAlchemy poolclass which holds one of the user's
+    QUERY_GOVERNOR_SLOTS for as long as each connection is checked out.
+
+    Once max_concurrent_queries connections are checked out, in any process, further
+    checkouts wait for up to QUERY_GOVERNOR_QUEUE_TIMEOUT seconds, then fail with
+    SQLAlchemy's TimeoutError.
+    """
+    key = (poolclass, username, max_concurrent_queries)
+    pool_class = _user_pool_classes.get(key)
+    if pool_class is not None:
+        return pool_class
+
+    slots = current_app.config["QUERY_GOVERNOR_SLOTS"]
+    queue_timeout = current_app.config["QUERY_GOVERNOR_QUEUE_TIMEOUT"]
+
+    class UserQuerySlotsPool(poolclass):
+        def _do_get(self):
+            slot = slots.acquire(username, max_concurrent_queries, wait=queue_timeout)
+            if slot is None:
+                raise PoolTimeoutError(
+                    f"{username} already runs {max_concurrent_queries} queries, "
+                    f"timed out after {queue_timeout} seconds"
+                )
+            try:
+                record = super()._do_get()
+            except BaseException:
+                slots.release(username, slot)
+                raise
+            record.info["query_slot"] = slot
+            return record
+
+        def _do_return_conn(self, record):
+            slot = record.info.pop("query_slot", None)
+            try:
+                super()._do_return_conn(record)
+            finally:
+                if slot is not None:
+                    slots.release(username, slot)
+
+    _user_pool_classes.set(key, UserQuerySlotsPool)
+    return UserQuerySlotsPool
+
+
+def get_query_user(username, security_manager):
+    """
+    Returns the user a query runs for: the current user, or the given one.
+    """
+    user = getattr(g, "user", None) if has_app_context() else None
+    if (user is None or not user.is_authenticated) and username:
+        user = security_manager.find_user(username=username)
+    return user if user is not None and user.is_authenticated else None
+
+
+def get_query_limits(user):
+    """
+    Returns the (role key, limits) of the QUERY_GOVERNOR role that applies to the user.
+
+    QUERY_GOVERNOR is keyed by the role keys of AUTH_ROLES_MAPPING ("admin", "alpha",
+    "openedx"...): the first one that maps to one of the user's roles applies. Users
+    without any of these roles get the limits of the last, most restrictive, one.
+    """
+    config = current_app.config
+    governor = config["QUERY_GOVERNOR"]
+    if not governor:
+        return None, {}
+    role_names = {role.name for role in user.roles} if user else set()
+    for role_key, limits in governor.items():
+        if role_names.intersection(config["AUTH_ROLES_MAPPING"].get(role_key, [])):
+            return role_key, limits
+    return role_key, limits  # pylint: disable=undefined-loop-variable
+
+
+def is_clickhouse(url):
+    """
+    Returns True if the SQLAlchemy URL is for a ClickHouse database.
+    """
+    return url.get_backend_name() in CLICKHOUSE_DRIVERS
+
+
+def is_clickhouse_connect(url):
+    """
+    Returns True if the SQLAlchemy URL is for a ClickHouse database, through clickhouse-connect.
+    """
+    return url.get_backend_name() == CLICKHOUSE_CONNECT_DRIVER
+
+
+def get_course_access_engine():
+    """
+    Returns the engine of the COURSE_ACCESS_TABLE_DATABASE Superset database.
+    """
+    from superset import db  # pylint: disable=import-outside-toplevel
+    from superset.models.core import Database  # pylint: disable=import-outside-toplevel
+
+    database = (
+        db.session.query(Database)
+        .filter_by(database_name=current_app.config["COURSE_ACCESS_TABLE_DATABASE"])
+        .one()
+    )
+    return database.get_sqla_engine()
+
+
+def get_course_access_table():
+    """
+    Returns the name of the COURSE_ACCESS_TABLE, qualified with its ClickHouse database.
+    """
+    config = current_app.config
+    return f"{config['COURSE_ACCESS_TABLE_SCHEMA']}.{config['COURSE_ACCESS_TABLE']}"
+
+
+def uses_course_access_table(course_ids):
+    """
+    Returns True if the course filter of the given (deduplicated) course IDs refers to
+    the COURSE_ACCESS_TABLE, rather than listing them inline.
+    """
+    config = current_app.config
+    return (
+        config["COURSE_FILTER_LARGE_STRATEGY"] == "table"
+        and bool(config["COURSE_ACCESS_TABLE_DATABASE"])
+        and len(course_ids) > config["COURSE_FILTER_INLINE_MAX"]
+    )
+
+
+def course_access_key(course_ids):
+    """
+    Returns the key of the given sorted, deduplicated course IDs in the COURSE_ACCESS_TABLE.
+    """
+    return hashlib.sha256("\n".join(course_ids).encode("utf-8")).hexdigest()[:32]
+
+
+def write_course_access(courses):
+    """
+    Stores the given courses in the ClickHouse COURSE_ACCESS_TABLE, if their course filter
+    refers to it, and returns their access key (or None).
+
+    This is called whenever a user's courses are fetched, rather than when their course
+    filter is rendered, so that rendering SQL never writes to ClickHouse. Each process
+    only writes a given access key once an hour: rows are kept for
+    COURSE_ACCESS_TABLE_TTL_DAYS, and rewriting them pushes back their expiry.
+    """
+    global _course_access_table_created  # pylint: disable=global-statement
+    course_ids = sorted(set(courses))
+    if not uses_course_access_table(course_ids):
+        return None
+    access_key = course_access_key(course_ids)
+    if _written_access_keys.get(access_key):
+        return access_key
+
+    config = current_app.config
+    table = get_course_access_table()
+    connection = get_course_access_engine().raw_connection()
+    try:
+        client = connection.connection.client
+        if not _course_access_table_created:
+            client.command(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "access_key String, course_id String, updated_on DateTime DEFAULT now()"
+                ") ENGINE = ReplacingMergeTree(updated_on) ORDER BY (access_key, course_id) "
+                f"TTL updated_on + INTERVAL {int(config['COURSE_ACCESS_TABLE_TTL_DAYS'])} DAY"
+            )
+            _course_access_table_created = True
+        client.insert(
+            config["COURSE_ACCESS_TABLE"],
+            [(access_key, course_id) for course_id in course_ids],
+            column_names=["access_key", "course_id"],
+            database=config["COURSE_ACCESS_TABLE_SCHEMA"],
+        )
+    finally:
+        connection.close()
+    _written_access_keys.set(access_key, True)
+    return access_key
+
+
+def mutate_connection(
+    url, params, username, security_manager, source
+):  # pylint: disable=unused-argument
+    """
+    DB_CONNECTION_MUTATOR which applies the connection pool and query governor to ClickHouse.
+
+    The concurrent query limits apply to every ClickHouse driver, but the shared pool and
+    the clickhouse_settings only to clickhouse-connect.
+    """
+    if not is_clickhouse(url):
+        return url, params
+
+    user = get_query_user(username, security_manager)
+    role_key, limits = get_query_limits(user)
+
+    max_concurrent_queries = limits.get("max_concurrent_queries")
+    if user is not None and max_concurrent_queries:
+        # Superset passes NullPool, unless the database sets another poolclass
+        params["poolclass"] = get_user_pool_class(
+            params.get("poolclass") or QueuePool, user.username, max_concurrent_queries
+        )
+
+    if not is_clickhouse_connect(url):
+        return url, params
+
+    connect_args = params.setdefault("connect_args", {})
+    connect_args["pool_mgr"] = get_clickhouse_pool_manager()
+    if limits.get("clickhouse_settings"):
+        settings = dict(connect_args.get("settings") or {})
+        settings.update(limits["clickhouse_settings"])
+        connect_args["settings"] = settings
+        log.debug("Applying the %s query limits to %s", role_key, user)
+    return url, params
@@ -0,0 +1,301 @@
+"""
+Streaming CSV and Parquet exports of chart and SQL Lab query results.
+
+Superset builds CSV downloads in memory, which large xAPI exports cannot afford. These
+endpoints instead fetch the rows in chunks of OPENEDX_EXPORT_CHUNK_SIZE and write each
+chunk out before fetching the next, so memory use does not depend on the number of rows:
+
+    /openedx/export/chart/<chart id>.<csv|parquet>
+    /openedx/export/sqllab/<query client id>.<csv|parquet>
+
+The exported SQL is rendered for the current user, so `can_view_courses` and the
+dataset's row level security filters apply as they do in Superset. Chart exports contain
+the rows of the chart's query, before any post-processing.
+
+With OPENEDX_EXPORT_MODE = "file", the export is first written to OPENEDX_EXPORT_DIR, so
+that the database connection is released without waiting for the client to download it.
+
+The "Download as CSV" actions of Superset's UI are left as they are: their results are
+bounded by ROW_LIMIT and SQL_MAX_ROW, so they fit in memory, and streaming them would
+mean replacing Superset's chart data API and SQL Lab views. These endpoints are for
+the exports beyond those limits, up to OPENEDX_EXPORT_MAX_ROWS.
+"""
+import csv
+import json
+import logging
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    after_this_request,
+    current_app,
+    g,
+    send_file,
+    stream_with_context,
+)
+
+from openedx_db import is_clickhouse_connect
+
+log = logging.getLogger(__name__)
+
+export_blueprint = Blueprint("openedx_export", __name__, url_prefix="/openedx/export")
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ChunkSink:
+    """
+    Write-only file object which hands out what was written to it since the last drain().
+
+    It keeps track of its position, which the Parquet writer needs for its footer.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_csv(frames):
+    """
+    Yields the CSV encoding of the DataFrames, with one header row.
+    """
+    options = {"index": False, "quoting": csv.QUOTE_NONNUMERIC}
+    options.update(current_app.config["CSV_EXPORT"])
+    encoding = options.pop("encoding", "utf-8")
+    header = True
+    for frame in frames:
+        yield frame.to_csv(header=header, **options).encode(encoding)
+        header = False
+
+
+def iter_parquet(frames):
+    """
+    Yields the Parquet encoding of the DataFrames, one row group per DataFrame.
+    """
+    sink = ChunkSink()
+    writer = None
+    for frame in frames:
+        if writer is None:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            writer = pq.ParquetWriter(sink, table.schema)
+        else:
+            table = pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+ENCODERS = {
+    "csv": iter_csv,
+    "parquet": iter_parquet,
+}
+
+
+def iter_frames(engine, sql, chunk_size):
+    """
+    Runs the query and yields its results as DataFrames of up to chunk_size rows.
+    """
+    connection = engine.raw_connection()
+    try:
+        if is_clickhouse_connect(engine.url):
+            # The clickhouse-connect DB API cursor loads the whole result, so use the
+            # client's block stream instead.
+            client = connection.connection.client
+            with client.query_df_stream(sql, settings={"max_block_size": chunk_size}) as stream:
+                yield from stream
+        else:
+            cursor = connection.cursor()
+            cursor.execute(sql)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                yield pd.DataFrame.from_records(rows, columns=columns)
+                rows = cursor.fetchmany(chunk_size)
+    finally:
+        connection.close()
+
+
+def get_chart_sql(chart_id):
+    """
+    Returns the database, schema and SQL of the chart's query, for the current user.
+    """
+    from superset import db, security_manager  # pylint: disable=import-outside-toplevel
+    from superset.models.slice import Slice  # pylint: disable=import-outside-toplevel
+
+    chart = db.session.query(Slice).get(chart_id)
+    if chart is None:
+        abort(404)
+    query_context = chart.get_query_context()
+    if query_context is None:
+        abort(400, "This chart has no saved query, open and save it in Explore first.")
+    security_manager.raise_for_access(query_context=query_context)
+
+    query_obj = query_context.queries[0]
+    query_obj.row_limit = current_app.config["OPENEDX_EXPORT_MAX_ROWS"]
+    datasource = query_context.datasource
+    return datasource.database, datasource.schema, datasource.get_query_str(query_obj.to_dict())
+
+
+def get_sqllab_template_params(query):
+    """
+    Returns the template parameters of the SQL Lab tab the query was run from, or else of
+    the saved query the tab was opened from.
+    """
+    from superset import db  # pylint: disable=import-outside-toplevel
+    from superset.models.sql_lab import (  # pylint: disable=import-outside-toplevel
+        SavedQuery,
+        TabState,
+    )
+
+    # Without SQLLAB_BACKEND_PERSISTENCE, tabs are only kept by the browser
+    if not str(query.sql_editor_id or "").isdigit():
+        return {}
+    tab = db.session.query(TabState).get(int(query.sql_editor_id))
+    if tab is None or tab.user_id != query.user_id:
+        return {}
+    template_params = tab.template_params
+    if not template_params and tab.saved_query_id:
+        saved_query = db.session.query(SavedQuery).get(tab.saved_query_id)
+        template_params = saved_query.template_parameters if saved_query else None
+    try:
+        return json.loads(template_params or "{}")
+    except ValueError:
+        abort(400, "The template parameters of this query are not valid JSON.")
+
+
+def get_sqllab_sql(client_id):
+    """
+    Returns the database, schema and SQL of the current user's SQL Lab query, rendered with
+    its template parameters.
+    """
+    from superset import db, security_manager  # pylint: disable=import-outside-toplevel
+    from superset.jinja_context import (  # pylint: disable=import-outside-toplevel
+        get_template_processor,
+    )
+    from superset.models.sql_lab import Query  # pylint: disable=import-outside-toplevel
+    from superset.sql_parse import ParsedQuery  # pylint: disable=import-outside-toplevel
+
+    query = db.session.query(Query).filter_by(client_id=client_id).one_or_none()
+    if query is None or query.user_id != g.user.id:
+        abort(404)
+    security_manager.raise_for_access(query=query)
+
+    database = query.database
+    template_processor = get_template_processor(database=database, query=query)
+    sql = template_processor.process_template(query.sql, **get_sqllab_template_params(query))
+    if not ParsedQuery(sql).is_select():
+        abort(400, "Only SELECT queries can be exported.")
+    max_rows = current_app.config["OPENEDX_EXPORT_MAX_ROWS"]
+    if max_rows:
+        sql = database.apply_limit_to_sql(sql, max_rows)
+    return database, query.schema, sql
+
+
+def export(database, schema, sql, filename, file_format):
+    """
+    Returns the streamed, or stored then sent, export of the SQL query results.
+    """
+    config = current_app.config
+    engine = database.get_sqla_engine(schema=schema, user_name=g.user.username)
+    chunks = ENCODERS[file_format](iter_frames(engine, sql, config["OPENEDX_EXPORT_CHUNK_SIZE"]))
+
+    if config["OPENEDX_EXPORT_MODE"] == "file":
+        os.makedirs(config["OPENEDX_EXPORT_DIR"], exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=config["OPENEDX_EXPORT_DIR"], suffix=f".{file_format}", delete=False
+        ) as export_file:
+            try:
+                for chunk in chunks:
+                    export_file.write(chunk)
+            except Exception:
+                os.remove(export_file.name)
+                raise
+
+        @after_this_request
+        def remove_export_file(response):
+            # The file is already open for sending, so it can be unlinked
+            os.remove(export_file.name)
+            return response
+
+        return send_file(
+            export_file.name,
+            mimetype=MIMETYPES[file_format],
+            as_attachment=True,
+            download_name=filename,
+        )
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=MIMETYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def check_access():
+    """
+    Only authenticated users with the CSV export permission may export data.
+    """
+    from superset import security_manager  # pylint: disable=import-outside-toplevel
+
+    if not g.user or not g.user.is_authenticated:
+        abort(401)
+    if not security_manager.can_access("can_csv", "Superset"):
+        abort(403)
+
+
+def export_query(get_sql, key, name, file_format):
+    """
+    Exports the query returned by get_sql(key), after checking the user's access to it.
+    """
+    from superset.exceptions import (  # pylint: disable=import-outside-toplevel
+        SupersetSecurityException,
+    )
+
+    check_access()
+    try:
+        database, schema, sql = get_sql(key)
+    except SupersetSecurityException as error:
+        abort(403, str(error))
+    return export(database, schema, sql, f"{name}.{file_format}", file_format)
+
+
+@export_blueprint.route("/chart/<int:chart_id>.<any(csv, parquet):file_format>")
+def export_chart(chart_id, file_format):
+    return export_query(get_chart_sql, chart_id, f"chart_{chart_id}", file_format)
+
+
+@export_blueprint.route("/sqllab/<client_id>.<any(csv, parquet):file_format>")
+def export_sqllab_query(client_id, file_format):
+    return export_query(get_sqllab_sql, client_id, f"query_{client_id}", file_format)
@@ -0,0 +1,315 @@
+"""
+Incremental Superset initialization, run by the superset init task (init-superset.sh).
+
+Each step stores a fingerprint of its inputs in the metadata database, and is skipped on
+the next run if its fingerprint has not changed:
+
+- migrations: the migration head, the Superset version and the rendered Superset config
+  (`superset db upgrade` and `superset init`)
+- admin: the admin user's credentials
+- roles: the contents of roles.json, imported as a diff of the role permissions. Since
+  `superset init` resets the role permissions, this step also runs after the migrations.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime
+from importlib.metadata import version
+
+import sqlalchemy as sa
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import joinedload
+
+log = logging.getLogger(__name__)
+
+CONFIG_FILES = ("superset_config.py", "superset_config_docker.py")
+
+fingerprints_table = sa.Table(
+    "openedx_init_fingerprints",
+    sa.MetaData(),
+    sa.Column("step", sa.String(64), primary_key=True),
+    sa.Column("fingerprint", sa.String(128), nullable=False),
+    # Step-specific state, e.g. the permissions imported by the roles step
+    sa.Column("data", sa.Text().with_variant(mysql.LONGTEXT(), "mysql")),
+    sa.Column("updated_on", sa.DateTime, nullable=False),
+)
+
+
+def fingerprint(*values, key=b""):
+    """
+    Returns a hash of the values. Pass a key to store fingerprints of secrets.
+    """
+    digest = hmac.new(key, digestmod=hashlib.sha256)
+    for value in values:
+        digest.update(value.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class StepRunner:
+    """
+    Runs the init steps whose fingerprint changed, and records their new fingerprint.
+    """
+
+    def __init__(self, engine, force=False):
+        self.engine = engine
+        self.force = force
+        self.timings = []
+        fingerprints_table.create(engine, checkfirst=True)
+
+    def get(self, step):
+        """
+        Returns the stored (fingerprint, data) of the step, or (None, None).
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                fingerprints_table.select().where(fingerprints_table.c.step == step)
+            ).first()
+        return (row.fingerprint, row.data) if row else (None, None)
+
+    def save(self, step, step_fingerprint, data=None):
+        values = {"fingerprint": step_fingerprint, "data": data, "updated_on": datetime.utcnow()}
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                fingerprints_table.update()
+                .where(fingerprints_table.c.step == step)
+                .values(**values)
+            )
+            if not updated.rowcount:
+                connection.execute(fingerprints_table.insert().values(step=step, **values))
+
+    def run(self, step, step_fingerprint, fn, force=False):
+        """
+        Calls fn(previous_data) if the step's fingerprint changed, and stores the data it returns.
+
+        Returns True if the step ran.
+        """
+        start = time.monotonic()
+        previous_fingerprint, previous_data = self.get(step)
+        ran = previous_fingerprint != step_fingerprint or force or self.force
+        if ran:
+            print(f"Running init step: {step}", flush=True)
+            self.save(step, step_fingerprint, fn(previous_data))
+        self.timings.append((step, "done" if ran else "skipped", time.monotonic() - start))
+        return ran
+
+    def print_timings(self):
+        print("Init step timings:")
+        for step, status, elapsed in self.timings:
+            print(f"  {step:<12} {status:<8} {elapsed:7.2f}s")
+
+
+def get_migration_head():
+    """
+    Returns the head revision of the installed Superset's database migrations.
+    """
+    import superset  # pylint: disable=import-outside-toplevel
+
+    config = Config()
+    config.set_main_option(
+        "script_location", os.path.join(os.path.dirname(superset.__file__), "migrations")
+    )
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+def read_config_files():
+    """
+    Returns the contents of the rendered Superset config files, next to this module.
+    """
+    contents = []
+    for name in CONFIG_FILES:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as config_file:
+                contents.append(config_file.read())
+        else:
+            contents.append("")
+    return contents
+
+
+def get_database_revision(engine):
+    """
+    Returns the migration revision of the metadata database, or None if not migrated yet.
+    """
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def migrate(previous_data):  # pylint: disable=unused-argument
+    subprocess.run(["superset", "db", "upgrade"], check=True)
+    subprocess.run(["superset", "init"], check=True)
+
+
+def setup_admin(security_manager, username, password, email):
+    """
+    Creates the admin user, or resets their password if they already exist.
+    """
+    user = security_manager.find_user(username=username)
+    if user is None:
+        security_manager.add_user(
+            username,
+            "Superset",
+            "Admin",
+            email,
+            security_manager.find_role("Admin"),
+            password=password,
+        )
+    else:
+        security_manager.reset_password(user.id, password)
+
+
+def role_permissions(roles_data):
+    """
+    Returns the {role name: set of (permission, view menu)} described by roles.json data.
+    """
+    return {
+        role["name"]: {
+            (permission["permission"]["name"], permission["view_menu"]["name"])
+            for permission in role["permissions"]
+        }
+        for role in roles_data
+    }
+
+
+def import_roles(security_manager, roles, previous_roles):
+    """
+    Applies the permission changes between the previously imported and current roles.
+
+    Permissions missing from a role are added, and permissions that were imported
+    before but are no longer listed are removed. Permissions granted some other way,
+    e.g. by `superset init`, are left alone. All changes are made in one transaction.
+
+    If previous_roles is None, i.e. on the first import, nothing is known of how the
+    current permissions were granted: they are all taken as previously imported, so
+    that the roles end up with exactly the listed permissions.
+    """
+    session = security_manager.get_session
+    permission_model = security_manager.permission_model
+    view_menu_model = security_manager.viewmenu_model
+    permission_view_model = security_manager.permissionview_model
+
+    permissions = {permission.name: permission for permission in session.query(permission_model)}
+    view_menus = {view_menu.name: view_menu for view_menu in session.query(view_menu_model)}
+    permission_views = {
+        (permission_view.permission.name, permission_view.view_menu.name): permission_view
+        for permission_view in session.query(permission_view_model).options(
+            joinedload(permission_view_model.permission),
+            joinedload(permission_view_model.view_menu),
+        )
+        if permission_view.permission and permission_view.view_menu
+    }
+
+    def get_permission_view(permission_name, view_menu_name):
+        key = (permission_name, view_menu_name)
+        if key not in permission_views:
+            if permission_name not in permissions:
+                permissions[permission_name] = permission_model(name=permission_name)
+            if view_menu_name not in view_menus:
+                view_menus[view_menu_name] = view_menu_model(name=view_menu_name)
+            permission_view = permission_view_model()
+            permission_view.permission = permissions[permission_name]
+            permission_view.view_menu = view_menus[view_menu_name]
+            session.add(permission_view)
+            permission_views[key] = permission_view
+        return permission_views[key]
+
+    added = removed = 0
+    try:
+        for role_name, wanted in roles.items():
+            role = security_manager.find_role(role_name)
+            if role is None:
+                role = security_manager.role_model(name=role_name)
+                session.add(role)
+            current = {
+                (permission_view.permission.name, permission_view.view_menu.name)
+                for permission_view in role.permissions
+            }
+            for key in sorted(wanted - current):
+                role.permissions.append(get_permission_view(*key))
+                added += 1
+            previous = current if previous_roles is None else previous_roles.get(role_name, set())
+            for key in previous - wanted:
+                if key in current:
+                    role.permissions.remove(permission_views[key])
+                    removed += 1
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    print(f"Role permissions added: {added}, removed: {removed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--roles", default="/app/data/roles.json", help="Roles file to import")
+    parser.add_argument("--force", action="store_true", help="Run every step")
+    args = parser.parse_args()
+
+    from superset.app import create_app  # pylint: disable=import-outside-toplevel
+
+    app = create_app()
+    with app.app_context():
+        from superset import db, security_manager  # pylint: disable=import-outside-toplevel
+
+        runner = StepRunner(db.engine, force=args.force)
+        # The config files hold secrets, so only their HMAC is stored
+        secret_key = app.config["SECRET_KEY"].encode()
+
+        head = get_migration_head()
+        migrations_fingerprint = fingerprint(
+            head, version("apache-superset"), *read_config_files(), key=secret_key
+        )
+        migrated = runner.run(
+            "migrations",
+            migrations_fingerprint,
+            migrate,
+            # e.g. if the database was restored from an older backup
+            force=get_database_revision(db.engine) != head,
+        )
+        db.session.remove()
+
+        username = os.environ["SUPERSET_ADMIN_USERNAME"]
+        password = os.environ["SUPERSET_ADMIN_PASSWORD"]
+        email = os.environ["SUPERSET_ADMIN_EMAIL"]
+        runner.run(
+            "admin",
+            fingerprint(username, password, email, key=secret_key),
+            lambda previous_data: setup_admin(security_manager, username, password, email),
+        )
+
+        with open(args.roles, encoding="utf-8") as roles_file:
+            roles_json = roles_file.read()
+        roles = role_permissions(json.loads(roles_json))
+
+        def update_roles(previous_data):
+            previous_roles = None
+            if previous_data is not None:
+                previous_roles = {
+                    role_name: {tuple(key) for key in keys}
+                    for role_name, keys in json.loads(previous_data).items()
+                }
+            import_roles(security_manager, roles, previous_roles)
+            return json.dumps({role_name: sorted(keys) for role_name, keys in roles.items()})
+
+        # `superset init` resets the role permissions: re-import the roles after it ran,
+        # including when the roles step failed after a previous run of the migrations.
+        runner.run(
+            "roles",
+            fingerprint(roles_json, migrations_fingerprint),
+            update_roles,
+            force=migrated,
+        )
+
+    runner.print_timings()
+
+
+if __name__ == "__main__":
+    main()
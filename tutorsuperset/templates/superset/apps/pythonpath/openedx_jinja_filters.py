@@ -3,39 +3,154 @@ Custom Jinja template filters that can be used in Superset queries.
 
 cf https://superset.apache.org/docs/installation/sql-templating/
 """
+from collections import Counter
+
+from flask import current_app, g
 from superset.extensions import security_manager
 
+from openedx_db import course_access_key, get_course_access_table
+
 ALL_COURSES = "1 = 1"
 NO_COURSES = "1 = 0"
 
-def can_view_courses(username, field_name='course_id'):
+# Per-process counters of the lookups made by get_user_access and get_user_courses
+ACCESS_CONTEXT_STATS = Counter()
+
+
+def _access_contexts():
     """
-    Returns SQL WHERE clause which restricts access to the courses the current user has staff access to.
+    Returns the access contexts resolved during the current request, keyed by username.
     """
+    return g.setdefault("openedx_access_contexts", {})
+
+
+def get_user_access(username):
+    """
+    Returns the access context for the given user: a dict of their role names and course lists.
+
+    The context is stored on flask.g, so the user and their roles are only looked up once
+    per request (or Celery task), however many queries are rendered.
+    """
+    contexts = _access_contexts()
+    context = contexts.get(username)
+    if context is not None:
+        ACCESS_CONTEXT_STATS["user_hits"] += 1
+        return context
+
+    ACCESS_CONTEXT_STATS["user_lookups"] += 1
     user = security_manager.get_user_by_username(username)
     if user:
         user_roles = security_manager.get_user_roles(user)
     else:
         user_roles = []
 
+    context = {
+        "roles": [str(role) for role in user_roles],
+        "courses": {},
+    }
+    contexts[username] = context
+    return context
+
+
+def get_user_courses(username, permission="staff"):
+    """
+    Returns the courses the given user has the given permission on, looked up once per request.
+    """
+    context = _access_contexts().get(username) or get_user_access(username)
+    courses = context["courses"]
+    if permission in courses:
+        ACCESS_CONTEXT_STATS["course_hits"] += 1
+    else:
+        ACCESS_CONTEXT_STATS["course_lookups"] += 1
+        courses[permission] = security_manager.get_courses(username, permission=permission)
+    return courses[permission]
+
+
+def _quote(course_id):
+    """
+    Returns the given course ID as a quoted SQL string literal.
+    """
+    escaped = course_id.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def inline_course_filter(course_ids, field_name):
+    """
+    Returns a `field in (...)` clause: best for short lists of courses.
+    """
+    course_id_list = ", ".join(_quote(course_id) for course_id in course_ids)
+    return f"{field_name} in ({course_id_list})"
+
+
+def table_course_filter(course_ids, field_name):
+    """
+    Returns a `field in (select ... from COURSE_ACCESS_TABLE ...)` clause: best for long lists.
+
+    The courses were stored in the ClickHouse COURSE_ACCESS_TABLE under a hash of the
+    list when they were fetched (cf openedx_db.write_course_access), so the SQL has the
+    same short length whatever the number of courses, and still changes (with the query
+    cache key) whenever the list does. ClickHouse can use the primary key of the filtered
+    table for an `in` subquery, as for an inline list.
+    """
+    access_key = course_access_key(course_ids)
+    table = get_course_access_table()
+    return (
+        f"{field_name} in (select course_id from {table} where access_key = '{access_key}')"
+    )
+
+
+COURSE_FILTER_STRATEGIES = {
+    "inline": inline_course_filter,
+    "table": table_course_filter,
+}
+
+
+def course_filter(courses, field_name='course_id'):
+    """
+    Returns a SQL WHERE clause which restricts the given field to the given courses.
+
+    Course IDs are deduplicated and sorted, so the same set of courses always
+    produces the same SQL (and so the same query cache key).
+    Lists longer than COURSE_FILTER_INLINE_MAX use COURSE_FILTER_LARGE_STRATEGY.
+    """
+    course_ids = sorted(set(courses))
+    if not course_ids:
+        return NO_COURSES
+
+    config = current_app.config
+    large_strategy = config["COURSE_FILTER_LARGE_STRATEGY"]
+    if large_strategy == "table" and not config["COURSE_ACCESS_TABLE_DATABASE"]:
+        # There is nowhere to store the access table
+        large_strategy = "inline"
+    if len(course_ids) <= config["COURSE_FILTER_INLINE_MAX"]:
+        strategy = "inline"
+    else:
+        strategy = large_strategy
+    sql = COURSE_FILTER_STRATEGIES[strategy](course_ids, field_name)
+
+    stats = config["STATS_LOGGER"]
+    stats.incr(f"openedx.course_filter.{strategy}")
+    stats.timing("openedx.course_filter.courses", len(course_ids))
+    stats.timing("openedx.course_filter.sql_length", len(sql))
+    return sql
+
+
+def can_view_courses(username, field_name='course_id'):
+    """
+    Returns SQL WHERE clause which restricts access to the courses the current user has staff access to.
+    """
+    user_roles = get_user_access(username)["roles"]
+
     # Users with no roles don't get to see any courses
     if not user_roles:
         return NO_COURSES
 
     # Superusers and global staff have access to all courses
     for role in user_roles:
-        if str(role) == "Admin" or str(role) == "Alpha":
+        if role == "Admin" or role == "Alpha":
             return ALL_COURSES
 
     # Everyone else only has access if they're staff on a course.
-    courses = security_manager.get_courses(username)
-
-    # TODO: what happens when the list of courses grows beyond what the query will handle?
-    if courses:
-        course_id_list = ", ".join(
-            f"'{course_id}'" for course_id in courses
-        )
-        return f"{field_name} in ({course_id_list})"
-    else:
-        # If you're not course staff on any courses, you don't get to see any.
-        return NO_COURSES
+    # If you're not course staff on any courses, you don't get to see any.
+    courses = get_user_courses(username)
+    return course_filter(courses, field_name)
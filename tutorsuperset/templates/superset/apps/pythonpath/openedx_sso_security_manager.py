@@ -1,14 +1,116 @@
+import hashlib
 import logging
+import time
 from collections import namedtuple
+from functools import partial
 
 import jwt
+import requests
 from authlib.common.urls import add_params_to_qs, add_params_to_uri
-from flask import current_app, session
+from flask import current_app, has_request_context, session
+from superset.extensions import celery_app
 from superset.security import SupersetSecurityManager
-from superset.utils.memoized import memoized
+
+from openedx_api import fetch_json, iter_paginated_results, post_form
+from openedx_cache import LRUCache
+from openedx_db import write_course_access
 
 log = logging.getLogger(__name__)
 
+AccessTokenClaims = namedtuple(
+    "AccessTokenClaims",
+    [
+        "preferred_username",
+        "name",
+        "email",
+        "given_name",
+        "family_name",
+        "superuser",
+        "administrator",
+        "exp",
+    ],
+)
+
+
+class CourseAccessUnavailable(Exception):
+    """
+    Raised when the courses of a user can't be known, so that no query runs without them.
+    """
+
+
+# Decoded access token claims, keyed by token fingerprint
+_claims_cache = LRUCache(max_size=1024, timeout=3600)
+# Access token of the superset-service user, cf get_service_access_token
+_service_token_cache = LRUCache(max_size=1, timeout=3600)
+
+
+def token_fingerprint(token):
+    """
+    Returns a short digest identifying the given token, so the token itself isn't used as a key.
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+def decode_claims(token):
+    """
+    Returns the AccessTokenClaims of the given JWT access token.
+
+    Tokens are only decoded once: the claims are cached until the token expires, and
+    those of expired tokens are not cached.
+    """
+    fingerprint = token_fingerprint(token)
+    claims = _claims_cache.get(fingerprint)
+    if claims is None:
+        decoded = jwt.decode(token, algorithms=["HS256"], options={"verify_signature": False})
+        claims = AccessTokenClaims(
+            preferred_username=decoded.get("preferred_username"),
+            name=decoded.get("name"),
+            email=decoded.get("email"),
+            given_name=decoded.get("given_name"),
+            family_name=decoded.get("family_name"),
+            superuser=bool(decoded.get("superuser", False)),
+            administrator=bool(decoded.get("administrator", False)),
+            exp=decoded.get("exp"),
+        )
+        timeout = max(claims.exp - time.time(), 0) if claims.exp else None
+        if timeout != 0:
+            _claims_cache.set(fingerprint, claims, timeout=timeout)
+    return claims
+
+
+def get_service_access_token():
+    """
+    Returns an access token of the global staff superset-service user, obtained with its
+    client credentials (OPENEDX_SERVICE_CLIENT_ID and OPENEDX_SERVICE_CLIENT_SECRET).
+
+    The LMS lists the courses of any user to global staff, so this token is used to
+    refresh course access outside of the users' requests. It is kept in this process
+    only, until it expires within OAUTH2_TOKEN_REFRESH_LEEWAY seconds.
+    """
+    token = _service_token_cache.get("access_token")
+    if token is not None:
+        return token
+
+    config = current_app.config
+    [provider] = [
+        provider for provider in config["OAUTH_PROVIDERS"] if provider["name"] == "openedxsso"
+    ]
+    token = post_form(
+        provider["remote_app"]["access_token_url"],
+        data={
+            "grant_type": "client_credentials",
+            "client_id": config["OPENEDX_SERVICE_CLIENT_ID"],
+            "client_secret": config["OPENEDX_SERVICE_CLIENT_SECRET"],
+            "token_type": "jwt",
+        },
+        timeout=config["OPENEDX_API_TIMEOUT"],
+    )["access_token"]
+    exp = decode_claims(token).exp
+    timeout = exp - time.time() - config["OAUTH2_TOKEN_REFRESH_LEEWAY"] if exp else None
+    if timeout is None or timeout > 0:
+        _service_token_cache.set("access_token", token, timeout=timeout)
+    return token
+
 
 def add_to_headers(token, headers=None):
     """Add a Bearer Token to the request URI.
@@ -50,21 +152,24 @@ class OpenEdxSsoSecurityManager(SupersetSecurityManager):
         return res
     
     def decoded_user_info(self):
-        return jwt.decode(self.access_token, algorithms=["HS256"], options={"verify_signature": False})
+        """
+        Returns the AccessTokenClaims of the current access token.
+        """
+        return decode_claims(self.access_token)
 
     def oauth_user_info(self, provider, response=None):
         if provider == 'openedxsso':
             user_profile = self.decoded_user_info()
 
-            user_roles = self._get_user_roles(user_profile.get('preferred_username'))
+            user_roles = self._get_user_roles(user_profile.preferred_username)
 
             return {
-                'name': user_profile['name'],
-                'email': user_profile['email'],
-                'id': user_profile['preferred_username'],
-                'username': user_profile['preferred_username'],
-                'first_name': user_profile.get('given_name') or user_profile.get('name', ''),
-                'last_name': user_profile.get('family_name'),
+                'name': user_profile.name,
+                'email': user_profile.email,
+                'id': user_profile.preferred_username,
+                'username': user_profile.preferred_username,
+                'first_name': user_profile.given_name or user_profile.name or '',
+                'last_name': user_profile.family_name,
                 'role_keys': user_roles,
             }
 
@@ -72,10 +177,81 @@ class OpenEdxSsoSecurityManager(SupersetSecurityManager):
         """
         Retrieves the oauth token from the session.
 
+        Tokens which expire within OAUTH2_TOKEN_REFRESH_LEEWAY seconds are refreshed first.
+
         Returns an empty hash if there is no session.
         """
-        # TODO: handle refreshing expired tokens?
-        return session.get("oauth_token", {})
+        token = session.get("oauth_token", {})
+        if token.get("access_token") and self._token_expires_soon(token):
+            token = self.refresh_oauth_token(token) or token
+        return token
+
+    def _token_expires_soon(self, token):
+        exp = decode_claims(token["access_token"]).exp
+        if not exp:
+            return False
+        return exp - time.time() < current_app.config["OAUTH2_TOKEN_REFRESH_LEEWAY"]
+
+    def refresh_oauth_token(self, token):
+        """
+        Exchanges the refresh token of the given OAuth token for a new token, and stores it in the session.
+
+        Concurrent refreshes of the same token, in this or other processes, share a single
+        request to the Open edX token endpoint. The new token is only shared within this
+        process: requests in other processes wait for the refresh to finish, then use the
+        token of their own session, which is still valid for OAUTH2_TOKEN_REFRESH_LEEWAY
+        seconds, cf _session_refreshed_token.
+
+        Returns None if the token could not be refreshed.
+        """
+        refresh_token = token.get("refresh_token")
+        oauth_remote = self.oauth_remotes.get(session.get("oauth_provider"))
+        if not refresh_token or not oauth_remote:
+            return None
+
+        new_token = current_app.config["OPENEDX_SINGLE_FLIGHT"].do(
+            f"refresh_token:{token_fingerprint(refresh_token)}",
+            partial(self._request_token_refresh, oauth_remote, refresh_token),
+            waited=partial(self._session_refreshed_token, refresh_token),
+        )
+        if new_token:
+            session["oauth_token"] = new_token
+        return new_token
+
+    def _session_refreshed_token(self, refresh_token):
+        """
+        Returns the token of the session if it was refreshed since it had the given
+        refresh token, else None.
+        """
+        token = session.get("oauth_token", {})
+        if token.get("refresh_token") in (None, refresh_token):
+            return None
+        return token
+
+    def _request_token_refresh(self, oauth_remote, refresh_token):
+        """
+        Requests a new token from the Open edX token endpoint using the given refresh token.
+        """
+        try:
+            new_token = post_form(
+                oauth_remote.access_token_url,
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token,
+                    "client_id": oauth_remote.client_id,
+                    "client_secret": oauth_remote.client_secret,
+                    "token_type": "jwt",
+                },
+                timeout=current_app.config["OPENEDX_API_TIMEOUT"],
+            )
+        except requests.RequestException:
+            current_app.config["STATS_LOGGER"].incr("openedx.lms.refresh_token.error")
+            log.exception("Unable to refresh the oauth token")
+            return None
+
+        if "expires_in" in new_token:
+            new_token["expires_at"] = int(time.time()) + int(new_token["expires_in"])
+        return new_token
 
     @property
     def access_token(self):
@@ -89,10 +265,10 @@ class OpenEdxSsoSecurityManager(SupersetSecurityManager):
         Returns the Superset roles that should be associated with the given user.
         """
         decoded_access_token = self.decoded_user_info()
-        
-        if decoded_access_token.get("superuser", False):
+
+        if decoded_access_token.superuser:
             return ["admin", "openedx"]
-        elif decoded_access_token.get("administrator", False):
+        elif decoded_access_token.administrator:
             return ["alpha", "openedx"]
         else:
             # User has to have staff access to one or more courses to view any content here.
@@ -101,39 +277,142 @@ class OpenEdxSsoSecurityManager(SupersetSecurityManager):
                 return ["openedx"]
             return []
 
-    @memoized(watch=('access_token',))
-    def get_courses(self, username, permission="staff", next_url=None):
+    @property
+    def course_access_cache(self):
+        """
+        Returns the course access cache shared by all Superset processes.
+        """
+        return current_app.config["COURSE_ACCESS_CACHE"]
+
+    def get_courses(self, username, permission="staff"):
         """
         Returns the list of courses the current user has access to.
+
+        Results are cached per (username, permission), so only a cold cache miss calls the
+        Open edX API from the request thread. Stale entries are returned immediately, and
+        refreshed by a Celery task, with the service access token: the user's own token
+        never leaves this process.
+
+        Raises CourseAccessUnavailable if the courses are neither cached nor can be fetched,
+        e.g. in a Celery task, rather than returning no courses: an empty result could
+        otherwise be cached as the user's chart data.
         """
-        courses = []
-        provider = session.get("oauth_provider")
-        oauth_remote = self.oauth_remotes.get(provider)
-        if not oauth_remote:
-            logging.error("No OAuth2 provider? expected openedx")
+        cache = self.course_access_cache
+        courses, is_stale = cache.get(username, permission)
+        stats = current_app.config["STATS_LOGGER"]
+        if courses is None:
+            stats.incr("openedx.course_access.miss")
+        else:
+            stats.incr("openedx.course_access.stale" if is_stale else "openedx.course_access.hit")
+
+        access_token = self._session_access_token()
+        if access_token:
+            cache.touch(username, permission)
+
+        if courses is not None:
+            if is_stale and cache.claim_refresh(username, permission):
+                celery_app.send_task(
+                    "openedx.refresh_course_access",
+                    args=(username, permission),
+                )
             return courses
 
-        token = self.get_oauth_token()
-        if not token:
+        if not has_request_context():
+            raise CourseAccessUnavailable(
+                f"The {permission} courses of {username} are not cached, and can only be "
+                "fetched during one of their requests"
+            )
+        if not access_token:
             logging.error("No oauth token? expected one provided by openedx")
+            return []
+
+        courses = self.refresh_courses(username, permission, access_token)
+        if courses is None:
+            raise CourseAccessUnavailable(f"Unable to fetch the {permission} courses of {username}")
+        return courses
+
+    def _session_access_token(self):
+        """
+        Returns the Open edX access token from the current session, or None if there isn't one.
+        """
+        if not has_request_context():
+            return None
+        provider = session.get("oauth_provider")
+        if not self.oauth_remotes.get(provider):
+            return None
+        return self.access_token
+
+    def refresh_courses(self, username, permission, access_token):
+        """
+        Fetches the courses for the given user from the Open edX API, and caches them.
+
+        Concurrent refreshes for the same user and permission, in this or other processes,
+        share a single crawl of the Open edX API.
+
+        Returns None if the request failed.
+        """
+        return current_app.config["OPENEDX_SINGLE_FLIGHT"].do(
+            f"courses:{permission}:{username}",
+            partial(self._fetch_and_cache_courses, username, permission, access_token),
+        )
+
+    def _fetch_and_cache_courses(self, username, permission, access_token):
+        courses = self._fetch_courses(username, permission, access_token)
+        if courses is None:
+            return None
+        # Long lists are stored in ClickHouse now, so that rendering their course filter
+        # doesn't have to (cf openedx_jinja_filters.table_course_filter)
+        try:
+            write_course_access(courses)
+        except Exception:  # pylint: disable=broad-except
+            # Not cached, so that the next lookup retries
+            log.exception("Unable to store the courses of %s in ClickHouse", username)
             return courses
+        self.course_access_cache.set(username, permission, courses)
+        return courses
+
+    def _fetch_courses(self, username, permission, access_token):
+        """
+        Fetches the list of courses the given user has access to from the Open edX API.
 
+        Returns None if the request could not be made.
+        """
         openedx_apis = current_app.config['OPENEDX_API_URLS']
         courses_url = openedx_apis['get_courses'].format(username=username, permission=permission)
-        url = next_url or courses_url
-        response = oauth_remote.get(url, token=token).json()
+        stats = current_app.config["STATS_LOGGER"]
+        fetch_json_page = partial(
+            fetch_json,
+            headers=add_to_headers(access_token),
+            timeout=current_app.config['OPENEDX_API_TIMEOUT'],
+        )
+        pages = []
 
-        for course in response.get('results', []):
-            course_id = course.get('course_id')
-            if course_id:
-                courses.append(course_id)
+        def fetch_page(url):
+            start = time.monotonic()
+            try:
+                return fetch_json_page(url)
+            finally:
+                pages.append(url)
+                stats.timing("openedx.lms.get_courses.page", (time.monotonic() - start) * 1000)
 
-        # Recurse to iterate over all the pages of results
-        if response.get("next"):
-            next_courses = self.get_courses(username, permission=permission, next_url=response['next'])
-            for course_id in next_courses:
-                courses.append(course_id)
+        start = time.monotonic()
+        try:
+            courses = [
+                course['course_id']
+                for course in iter_paginated_results(
+                    fetch_page, courses_url, max_workers=current_app.config['OPENEDX_API_MAX_WORKERS'],
+                )
+                if course.get('course_id')
+            ]
+        except requests.RequestException:
+            stats.incr("openedx.lms.get_courses.error")
+            log.exception("Unable to fetch the courses for %s", username)
+            return None
 
+        # Timers are used as histograms: StatsD aggregates them into percentiles
+        stats.timing("openedx.lms.get_courses", (time.monotonic() - start) * 1000)
+        stats.timing("openedx.lms.get_courses.pages", len(pages))
+        stats.timing("openedx.course_access.courses", len(courses))
         return courses
 
 
@@ -0,0 +1,147 @@
+"""
+Celery tasks for the Open edX integration.
+
+These are registered with Superset's Celery app through CELERY_IMPORTS in superset_config.py.
+"""
+import logging
+
+from flask import current_app
+from superset.extensions import celery_app, security_manager
+
+from openedx_sso_security_manager import get_service_access_token
+
+log = logging.getLogger(__name__)
+
+
+@celery_app.task(name="openedx.refresh_course_access", ignore_result=True)
+def refresh_course_access(username, permission):
+    """
+    Re-fetches the courses for the given user, and updates the course access cache.
+    """
+    courses = security_manager.refresh_courses(username, permission, get_service_access_token())
+    if courses is None:
+        log.warning("Unable to refresh the %s courses for %s", permission, username)
+
+
+@celery_app.task(name="openedx.refresh_active_course_access", ignore_result=True)
+def refresh_active_course_access():
+    """
+    Refreshes the cached courses of recently active users before they expire.
+    """
+    cache = current_app.config["COURSE_ACCESS_CACHE"]
+    refreshed = 0
+    for user in cache.active_users():
+        username, permission = user["username"], user["permission"]
+        if not cache.needs_refresh(username, permission):
+            continue
+        if not cache.claim_refresh(username, permission):
+            continue
+        access_token = get_service_access_token()
+        if security_manager.refresh_courses(username, permission, access_token) is not None:
+            refreshed += 1
+    log.info("Refreshed the course access of %d users", refreshed)
+
+
+def get_warmup_usernames():
+    """
+    Returns the users to warm dashboards for: one per access variant.
+
+    These are the configured CACHE_WARMUP_USERNAMES (e.g. one global staff user, whose
+    course filter is shared by all Admin and Alpha users), followed by the most recently
+    active course staff users, whose course lists are already in the course access cache.
+    """
+    config = current_app.config
+    usernames = list(config["CACHE_WARMUP_USERNAMES"])
+    max_active = config["CACHE_WARMUP_MAX_ACTIVE_USERS"]
+    if max_active:
+        active_users = sorted(
+            config["COURSE_ACCESS_CACHE"].active_users(),
+            key=lambda user: user["last_seen"],
+            reverse=True,
+        )
+        for user in active_users[:max_active]:
+            if user["username"] not in usernames:
+                usernames.append(user["username"])
+    return usernames
+
+
+def can_warm_for(user, permission="staff"):
+    """
+    Returns True if the user's course filter can be rendered outside of their requests.
+
+    Admin and Alpha users see all courses. Other users' courses can't be fetched from a
+    Celery task, so they are only warmed while their cached course list is fresh: a stale
+    or missing one would otherwise fail the queries, or cache outdated chart data.
+    """
+    if {role.name for role in user.roles}.intersection(("Admin", "Alpha")):
+        return True
+    courses, is_stale = current_app.config["COURSE_ACCESS_CACHE"].get(user.username, permission)
+    return courses is not None and not is_stale
+
+
+@celery_app.task(name="openedx.warm_dashboards", ignore_result=True)
+def warm_dashboards():
+    """
+    Queues the refresh of the charts of the CACHE_WARMUP_DASHBOARDS, for each warm-up user.
+
+    The work is split into CACHE_WARMUP_CONCURRENCY tasks which each refresh their charts
+    one at a time, so that warm-up never uses more than that many worker slots.
+    """
+    from superset import db  # pylint: disable=import-outside-toplevel
+    from superset.models.dashboard import Dashboard  # pylint: disable=import-outside-toplevel
+
+    config = current_app.config
+    id_or_slugs = [str(id_or_slug) for id_or_slug in config["CACHE_WARMUP_DASHBOARDS"]]
+    dashboards = db.session.query(Dashboard).filter(
+        Dashboard.slug.in_(id_or_slugs) | Dashboard.id.in_(
+            [int(value) for value in id_or_slugs if value.isdigit()]
+        )
+    )
+    chart_ids = sorted({chart.id for dashboard in dashboards for chart in dashboard.slices})
+    jobs = [
+        (chart_id, username)
+        for username in get_warmup_usernames()
+        for chart_id in chart_ids
+    ]
+
+    concurrency = max(1, config["CACHE_WARMUP_CONCURRENCY"])
+    for i in range(concurrency):
+        if jobs[i::concurrency]:
+            warm_charts.delay(jobs[i::concurrency])
+    log.info("Queued %d chart refreshes in %d tasks", len(jobs), min(concurrency, len(jobs)))
+
+
+@celery_app.task(name="openedx.warm_charts", ignore_result=True)
+def warm_charts(jobs):
+    """
+    Refreshes the cached data of each (chart_id, username) job in turn, as that user.
+
+    Running the queries as the user applies their row level security and course filters,
+    so each user's variant of the chart is cached. Jobs of users whose course list isn't
+    cached and fresh are skipped, cf can_warm_for.
+    """
+    from flask import g  # pylint: disable=import-outside-toplevel
+    from superset import db  # pylint: disable=import-outside-toplevel
+    from superset.models.slice import Slice  # pylint: disable=import-outside-toplevel
+
+    for chart_id, username in jobs:
+        user = security_manager.find_user(username=username)
+        chart = db.session.query(Slice).get(chart_id)
+        if not user or not chart:
+            continue
+        if not can_warm_for(user):
+            log.info("The courses of %s are not cached, not warming chart %s", username, chart_id)
+            continue
+
+        g.user = user
+        try:
+            query_context = chart.get_query_context()
+            if query_context is None:
+                log.info("Chart %s has no saved query context, not warming it", chart_id)
+                continue
+            query_context.force = True
+            query_context.get_payload()
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Unable to warm chart %s for %s", chart_id, username)
+        finally:
+            g.pop("user", None)
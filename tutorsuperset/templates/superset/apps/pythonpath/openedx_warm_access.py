@@ -0,0 +1,126 @@
+"""
+Pre-populates the course access cache for recently active Superset users.
+
+Run by `tutor [dev|local|k8s] do superset-warm-access`, e.g. after a deploy or a Redis flush.
+
+Open edX only lists a user's courses to that user or to global staff, so the courses
+are fetched with an access token of the global staff "superset-service" user, cf
+get_service_access_token.
+"""
+import argparse
+import logging
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Allows at most `rate` calls to wait() per second, across threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_active_usernames(days):
+    """
+    Returns the usernames of the active users who logged into Superset in the last `days` days.
+    """
+    from superset import db, security_manager  # pylint: disable=import-outside-toplevel
+
+    user_model = security_manager.user_model
+    since = datetime.now() - timedelta(days=days)
+    query = db.session.query(user_model.username).filter(
+        user_model.active.is_(True),
+        user_model.last_login >= since,
+    )
+    return [username for (username,) in query]
+
+
+def warm_access(app, days=30, permission="staff", concurrency=4, rate=10.0):
+    """
+    Refreshes the cached courses of recently active users, and prints a summary.
+
+    Returns True if every user was warmed.
+    """
+    from superset import security_manager  # pylint: disable=import-outside-toplevel
+
+    from openedx_sso_security_manager import (  # pylint: disable=import-outside-toplevel
+        get_service_access_token,
+    )
+
+    usernames = get_active_usernames(days)
+    access_token = get_service_access_token()
+
+    limiter = RateLimiter(rate)
+    timings = []
+    failures = []
+
+    def warm_user(username):
+        limiter.wait()
+        start = time.monotonic()
+        with app.app_context():
+            courses = security_manager.refresh_courses(username, permission, access_token)
+        timings.append(time.monotonic() - start)
+        if courses is None:
+            failures.append(username)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(warm_user, usernames))
+    elapsed = time.monotonic() - start
+
+    print(f"Active users in the last {days} days: {len(usernames)}")
+    print(f"Warmed: {len(usernames) - len(failures)}, failed: {len(failures)}")
+    if timings:
+        print(
+            f"Per-user fetch time: p50={statistics.median(timings):.3f}s "
+            f"max={max(timings):.3f}s"
+        )
+    print(
+        f"Total time: {elapsed:.1f}s, throughput: "
+        f"{len(usernames) / elapsed if elapsed else 0:.1f} users/s"
+    )
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--permission", default="staff")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum users warmed per second")
+    args = parser.parse_args()
+
+    from superset.app import create_app  # pylint: disable=import-outside-toplevel
+
+    app = create_app()
+    with app.app_context():
+        warmed = warm_access(
+            app,
+            days=args.days,
+            permission=args.permission,
+            concurrency=args.concurrency,
+            rate=args.rate,
+        )
+    sys.exit(0 if warmed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,13 +27,16 @@ Modified from original:
 https://github.com/apache/superset/blob/969c963/docker/pythonpath_dev/superset_config.py
 """
 import os
-from datetime import timedelta
 from typing import Optional
 
 from cachelib.redis import RedisCache
 from celery.schedules import crontab
+from redis import Redis
 from superset.superset_typing import CacheConfig
 
+from openedx_cache import CourseAccessCache, SingleFlight
+from openedx_db import QuerySlots, mutate_connection
+
 
 def get_env_variable(var_name: str, default: Optional[str] = None) -> str:
     """Get the environment variable or raise exception."""
@@ -67,48 +70,173 @@ SQLALCHEMY_DATABASE_URI = "%s://%s:%s@%s:%s/%s" % (
     DATABASE_DB,
 )
 
+# Connection pool of the metadata database, per process. Connections are checked
+# before use and recycled before MySQL drops them as idle.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int({{ SUPERSET_DB_POOL_SIZE }}),
+    "max_overflow": int({{ SUPERSET_DB_POOL_MAX_OVERFLOW }}),
+    "pool_timeout": int({{ SUPERSET_DB_POOL_TIMEOUT }}),
+    "pool_recycle": int({{ SUPERSET_DB_POOL_RECYCLE }}),
+    "pool_pre_ping": {{ SUPERSET_DB_POOL_PRE_PING }},
+}
+
+# Connections to the ClickHouse data sources share one pool per process, holding at most
+# CLICKHOUSE_POOL_MAXSIZE connections to each of up to CLICKHOUSE_POOL_NUM_POOLS servers.
+CLICKHOUSE_POOL_MAXSIZE = int({{ SUPERSET_CLICKHOUSE_POOL_MAXSIZE }})
+CLICKHOUSE_POOL_NUM_POOLS = int({{ SUPERSET_CLICKHOUSE_POOL_NUM_POOLS }})
+
+# Per-role limits of the ClickHouse queries, keyed by AUTH_ROLES_MAPPING role keys,
+# cf openedx_db.get_query_limits. Each role can set:
+# - max_concurrent_queries: per user, across all web and worker processes, cf
+#   QUERY_GOVERNOR_SLOTS
+# - clickhouse_settings: e.g. max_execution_time, max_memory_usage, priority, max_rows_to_read
+QUERY_GOVERNOR = {{ SUPERSET_QUERY_GOVERNOR }}
+# Seconds a query waits for one of the user's other queries to finish, before failing
+QUERY_GOVERNOR_QUEUE_TIMEOUT = int({{ SUPERSET_QUERY_GOVERNOR_QUEUE_TIMEOUT }})
+DB_CONNECTION_MUTATOR = mutate_connection
+
 REDIS_HOST = get_env_variable("REDIS_HOST")
 REDIS_PORT = get_env_variable("REDIS_PORT")
 REDIS_CELERY_DB = get_env_variable("REDIS_CELERY_DB", "0")
-REDIS_RESULTS_DB = get_env_variable("REDIS_RESULTS_DB", "1")
 REDIS_PASSWORD = get_env_variable("REDIS_PASSWORD", "")
 
-RESULTS_BACKEND = RedisCache(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_RESULTS_DB, key_prefix='superset_results')
+# Each cache tier has its own Redis host, DB, key prefix and default timeout,
+# cf the SUPERSET_CACHE_* settings.
+RESULTS_BACKEND = RedisCache(
+    host="{{ SUPERSET_CACHE_RESULTS_REDIS_HOST }}",
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD,
+    db={{ SUPERSET_CACHE_RESULTS_REDIS_DB }},
+    key_prefix="{{ SUPERSET_CACHE_RESULTS_KEY_PREFIX }}",
+    default_timeout={{ SUPERSET_CACHE_RESULTS_TIMEOUT }},
+)
+
+# SQL Lab results are stored as zlib-compressed Arrow/msgpack
+RESULTS_BACKEND_USE_MSGPACK = True
 
-CACHE_CONFIG = {
-    "CACHE_TYPE": "redis",
-    "CACHE_DEFAULT_TIMEOUT": 300,
-    "CACHE_KEY_PREFIX": "superset_",
-    "CACHE_REDIS_HOST": REDIS_HOST,
+# Cache for the list of courses each Open edX user has access to
+COURSE_ACCESS_CACHE = CourseAccessCache(
+    backend=RedisCache(
+        host="{{ SUPERSET_CACHE_METADATA_REDIS_HOST }}",
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db={{ SUPERSET_CACHE_METADATA_REDIS_DB }},
+        key_prefix="{{ SUPERSET_CACHE_METADATA_KEY_PREFIX }}course_access_",
+    ),
+    # Registry of the active users, cf CourseAccessCache.touch
+    redis=Redis(
+        host="{{ SUPERSET_CACHE_METADATA_REDIS_HOST }}",
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db={{ SUPERSET_CACHE_METADATA_REDIS_DB }},
+    ),
+    key_prefix="{{ SUPERSET_CACHE_METADATA_KEY_PREFIX }}course_access_",
+    timeout=int({{ SUPERSET_COURSE_ACCESS_CACHE_TIMEOUT }}),
+    stale_timeout=int({{ SUPERSET_COURSE_ACCESS_CACHE_STALE_TIMEOUT }}),
+    refresh_ahead=int({{ SUPERSET_COURSE_ACCESS_REFRESH_AHEAD }}),
+    active_timeout=int({{ SUPERSET_COURSE_ACCESS_ACTIVE_TIMEOUT }}),
+    max_entry_size=int({{ SUPERSET_COURSE_ACCESS_CACHE_MAX_COURSES }}),
+    l1_size=int({{ SUPERSET_COURSE_ACCESS_CACHE_L1_SIZE }}),
+)
+
+# Deduplicates concurrent calls to the Open edX APIs across all Superset processes
+OPENEDX_SINGLE_FLIGHT = SingleFlight(
+    backend=RedisCache(
+        host="{{ SUPERSET_CACHE_METADATA_REDIS_HOST }}",
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db={{ SUPERSET_CACHE_METADATA_REDIS_DB }},
+        key_prefix="{{ SUPERSET_CACHE_METADATA_KEY_PREFIX }}single_flight_",
+    ),
+)
+
+# Concurrent queries of each user, cf QUERY_GOVERNOR
+QUERY_GOVERNOR_SLOTS = QuerySlots(
+    redis=Redis(
+        host="{{ SUPERSET_CACHE_METADATA_REDIS_HOST }}",
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db={{ SUPERSET_CACHE_METADATA_REDIS_DB }},
+    ),
+    key_prefix="{{ SUPERSET_CACHE_METADATA_KEY_PREFIX }}query_slots_",
+    timeout=int({{ SUPERSET_QUERY_GOVERNOR_SLOT_TIMEOUT }}),
+)
+
+# Cache for Superset metadata
+CACHE_CONFIG: CacheConfig = {
+    "CACHE_TYPE": "openedx_cache.TieredRedisCache",
+    "CACHE_DEFAULT_TIMEOUT": {{ SUPERSET_CACHE_METADATA_TIMEOUT }},
+    "CACHE_KEY_PREFIX": "{{ SUPERSET_CACHE_METADATA_KEY_PREFIX }}",
+    "CACHE_REDIS_HOST": "{{ SUPERSET_CACHE_METADATA_REDIS_HOST }}",
     "CACHE_REDIS_PORT": REDIS_PORT,
-    'CACHE_REDIS_PASSWORD': REDIS_PASSWORD,
-    "CACHE_REDIS_DB": REDIS_RESULTS_DB,
+    "CACHE_REDIS_PASSWORD": REDIS_PASSWORD,
+    "CACHE_REDIS_DB": {{ SUPERSET_CACHE_METADATA_REDIS_DB }},
+    "CACHE_OPTIONS": {
+        "l1_size": {{ SUPERSET_CACHE_METADATA_L1_SIZE }},
+        "l1_timeout": {{ SUPERSET_CACHE_METADATA_L1_TIMEOUT }},
+    },
+}
+
+# Cache for chart data
+DATA_CACHE_CONFIG: CacheConfig = {
+    "CACHE_TYPE": "openedx_cache.TieredRedisCache",
+    "CACHE_DEFAULT_TIMEOUT": {{ SUPERSET_CACHE_DATA_TIMEOUT }},
+    "CACHE_KEY_PREFIX": "{{ SUPERSET_CACHE_DATA_KEY_PREFIX }}",
+    "CACHE_REDIS_HOST": "{{ SUPERSET_CACHE_DATA_REDIS_HOST }}",
+    "CACHE_REDIS_PORT": REDIS_PORT,
+    "CACHE_REDIS_PASSWORD": REDIS_PASSWORD,
+    "CACHE_REDIS_DB": {{ SUPERSET_CACHE_DATA_REDIS_DB }},
+    "CACHE_OPTIONS": {
+        "codec": "{{ SUPERSET_CACHE_DATA_CODEC }}",
+        "arrow_compression": {% if SUPERSET_CACHE_DATA_ARROW_COMPRESSION %}"{{ SUPERSET_CACHE_DATA_ARROW_COMPRESSION }}"{% else %}None{% endif %},
+        "compression_min_size": {{ SUPERSET_CACHE_DATA_COMPRESSION_MIN_SIZE }},
+    },
 }
-DATA_CACHE_CONFIG = CACHE_CONFIG
 
 # Cache for dashboard filter state
 FILTER_STATE_CACHE_CONFIG: CacheConfig = {
-    "CACHE_DEFAULT_TIMEOUT": int(timedelta(days=90).total_seconds()),
+    "CACHE_TYPE": "redis",
+    "CACHE_DEFAULT_TIMEOUT": {{ SUPERSET_CACHE_FILTER_STATE_TIMEOUT }},
     # should the timeout be reset when retrieving a cached value
     "REFRESH_TIMEOUT_ON_RETRIEVAL": True,
-    **CACHE_CONFIG,
+    "CACHE_KEY_PREFIX": "{{ SUPERSET_CACHE_FILTER_STATE_KEY_PREFIX }}",
+    "CACHE_REDIS_HOST": "{{ SUPERSET_CACHE_FILTER_STATE_REDIS_HOST }}",
+    "CACHE_REDIS_PORT": REDIS_PORT,
+    "CACHE_REDIS_PASSWORD": REDIS_PASSWORD,
+    "CACHE_REDIS_DB": {{ SUPERSET_CACHE_FILTER_STATE_REDIS_DB }},
 }
 
 # Cache for explore form data state
 EXPLORE_FORM_DATA_CACHE_CONFIG: CacheConfig = {
-    "CACHE_DEFAULT_TIMEOUT": int(timedelta(days=7).total_seconds()),
+    "CACHE_TYPE": "redis",
+    "CACHE_DEFAULT_TIMEOUT": {{ SUPERSET_CACHE_EXPLORE_FORM_DATA_TIMEOUT }},
     # should the timeout be reset when retrieving a cached value
     "REFRESH_TIMEOUT_ON_RETRIEVAL": True,
-    **CACHE_CONFIG,
+    "CACHE_KEY_PREFIX": "{{ SUPERSET_CACHE_EXPLORE_FORM_DATA_KEY_PREFIX }}",
+    "CACHE_REDIS_HOST": "{{ SUPERSET_CACHE_EXPLORE_FORM_DATA_REDIS_HOST }}",
+    "CACHE_REDIS_PORT": REDIS_PORT,
+    "CACHE_REDIS_PASSWORD": REDIS_PASSWORD,
+    "CACHE_REDIS_DB": {{ SUPERSET_CACHE_EXPLORE_FORM_DATA_REDIS_DB }},
 }
 
 class CeleryConfig(object):
     BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_CELERY_DB}"
-    CELERY_IMPORTS = ("superset.sql_lab",)
-    CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_RESULTS_DB}"
+    CELERY_IMPORTS = (
+        "superset.sql_lab",
+        {% if SUPERSET_GLOBAL_ASYNC_QUERIES %}"superset.tasks.async_queries",{% endif %}
+        "openedx_tasks",
+    )
+    CELERY_RESULT_BACKEND = f"redis://{{ SUPERSET_CACHE_RESULTS_REDIS_HOST }}:{REDIS_PORT}/{{ SUPERSET_CACHE_RESULTS_REDIS_DB }}"
     CELERYD_LOG_LEVEL = "DEBUG"
     CELERYD_PREFETCH_MULTIPLIER = 1
     CELERY_ACKS_LATE = False
+    # Route slow or bulk tasks to their own queues, so that each is consumed by a
+    # separate worker pool (cf SUPERSET_WORKER_POOLS) and cannot block the others.
+    CELERY_ROUTES = {
+{% for task_name, queue in SUPERSET_WORKER_ROUTES.items() %}
+        "{{ task_name }}": {"queue": "{{ queue }}"},
+{% endfor %}
+    }
     CELERYBEAT_SCHEDULE = {
         "reports.scheduler": {
             "task": "reports.scheduler",
@@ -118,6 +246,22 @@ class CeleryConfig(object):
             "task": "reports.prune_log",
             "schedule": crontab(minute=10, hour=0),
         },
+        "openedx.refresh_active_course_access": {
+            "task": "openedx.refresh_active_course_access",
+            "schedule": crontab(minute="*", hour="*"),
+        },
+{% if SUPERSET_CACHE_WARMUP_DASHBOARDS %}
+        "openedx.warm_dashboards": {
+            "task": "openedx.warm_dashboards",
+            "schedule": crontab(
+                minute="{{ SUPERSET_CACHE_WARMUP_SCHEDULE.split()[0] }}",
+                hour="{{ SUPERSET_CACHE_WARMUP_SCHEDULE.split()[1] }}",
+                day_of_month="{{ SUPERSET_CACHE_WARMUP_SCHEDULE.split()[2] }}",
+                month_of_year="{{ SUPERSET_CACHE_WARMUP_SCHEDULE.split()[3] }}",
+                day_of_week="{{ SUPERSET_CACHE_WARMUP_SCHEDULE.split()[4] }}",
+            ),
+        },
+{% endif %}
     }
 
 
@@ -131,6 +275,26 @@ WEBDRIVER_BASEURL_USER_FRIENDLY = WEBDRIVER_BASEURL
 
 SQLLAB_CTAS_NO_LIMIT = True
 
+{% if SUPERSET_GLOBAL_ASYNC_QUERIES %}
+# Global async queries: chart queries run on the Celery workers, and the browser polls
+# the web app for their completion, over the async events Redis streams.
+GLOBAL_ASYNC_QUERIES_REDIS_CONFIG = {
+    "host": "{{ SUPERSET_GLOBAL_ASYNC_QUERIES_REDIS_HOST }}",
+    "port": REDIS_PORT,
+    "password": REDIS_PASSWORD,
+    "db": int({{ SUPERSET_GLOBAL_ASYNC_QUERIES_REDIS_DB }}),
+    "ssl": False,
+}
+GLOBAL_ASYNC_QUERIES_REDIS_STREAM_PREFIX = "async-events-"
+GLOBAL_ASYNC_QUERIES_JWT_SECRET = "{{ SUPERSET_GLOBAL_ASYNC_QUERIES_JWT_SECRET }}"
+GLOBAL_ASYNC_QUERIES_JWT_COOKIE_NAME = "async-token"
+GLOBAL_ASYNC_QUERIES_JWT_COOKIE_SECURE = {{ ENABLE_HTTPS }}
+GLOBAL_ASYNC_QUERIES_JWT_COOKIE_SAMESITE = "Lax"
+GLOBAL_ASYNC_QUERIES_TRANSPORT = "polling"
+# Delay (in milliseconds) between the browser's polls for query results
+GLOBAL_ASYNC_QUERIES_POLLING_DELAY = int({{ SUPERSET_GLOBAL_ASYNC_QUERIES_POLLING_DELAY }})
+{% endif %}
+
 
 {% if SUPERSET_SENTRY_DSN %}
 import sentry_sdk
@@ -15,6 +15,10 @@ OPENEDX_LMS_ROOT_URL = os.environ["OPENEDX_LMS_ROOT_URL"]
 OPENEDX_API_URLS = {
     "get_courses": urljoin(OPENEDX_LMS_ROOT_URL, os.environ["OPENEDX_COURSES_LIST_PATH"]),
 }
+# Timeout (in seconds) for each request to the Open edX APIs
+OPENEDX_API_TIMEOUT = int({{ SUPERSET_OPENEDX_API_TIMEOUT }})
+# Number of result pages fetched concurrently from the Open edX APIs
+OPENEDX_API_MAX_WORKERS = int({{ SUPERSET_OPENEDX_API_MAX_WORKERS }})
 
 # Set the authentication type to OAuth
 AUTH_TYPE = AUTH_OAUTH
@@ -44,6 +48,14 @@ OAUTH_PROVIDERS = [
     }
 ]
 
+# OAuth tokens are refreshed when they expire within this many seconds
+OAUTH2_TOKEN_REFRESH_LEEWAY = int({{ SUPERSET_OAUTH2_TOKEN_REFRESH_LEEWAY }})
+
+# Client credentials of the global staff "superset-service" Open edX user, which
+# refreshes the course access of users outside of their requests
+OPENEDX_SERVICE_CLIENT_ID = os.environ["OPENEDX_SERVICE_CLIENT_ID"]
+OPENEDX_SERVICE_CLIENT_SECRET = os.environ["OPENEDX_SERVICE_CLIENT_SECRET"]
+
 # Will allow user self registration, allowing to create Flask users from Authorized User
 AUTH_USER_REGISTRATION = True
 
@@ -73,6 +85,7 @@ FEATURE_FLAGS = {
     "ALERT_REPORTS": True,
     "ENABLE_TEMPLATE_PROCESSING": True,
     "DASHBOARD_RBAC": True,
+    "GLOBAL_ASYNC_QUERIES": {{ SUPERSET_GLOBAL_ASYNC_QUERIES }},
 }
 
 # Add this custom template processor which returns the list of courses the current user can access
@@ -82,6 +95,52 @@ JINJA_CONTEXT_ADDONS = {
     'can_view_courses': can_view_courses,
 }
 
+# Lists of courses up to this size are filtered with `course_id in (...)`;
+# longer lists use COURSE_FILTER_LARGE_STRATEGY (cf openedx_jinja_filters.COURSE_FILTER_STRATEGIES)
+COURSE_FILTER_INLINE_MAX = int({{ SUPERSET_COURSE_FILTER_INLINE_MAX }})
+COURSE_FILTER_LARGE_STRATEGY = "{{ SUPERSET_COURSE_FILTER_LARGE_STRATEGY }}"
+# The "table" strategy stores long lists of courses in this ClickHouse table (in the
+# COURSE_ACCESS_TABLE_SCHEMA ClickHouse database) when they are fetched, written through
+# the Superset database named COURSE_ACCESS_TABLE_DATABASE. Until that is set, long lists
+# are filtered inline too.
+COURSE_ACCESS_TABLE = "{{ SUPERSET_COURSE_ACCESS_TABLE }}"
+COURSE_ACCESS_TABLE_SCHEMA = "{{ SUPERSET_COURSE_ACCESS_TABLE_SCHEMA }}"
+COURSE_ACCESS_TABLE_DATABASE = "{{ SUPERSET_COURSE_ACCESS_TABLE_DATABASE }}"
+COURSE_ACCESS_TABLE_TTL_DAYS = int({{ SUPERSET_COURSE_ACCESS_TABLE_TTL_DAYS }})
+
+# Streaming CSV and Parquet exports, cf openedx_export.py
+from openedx_export import export_blueprint
+
+BLUEPRINTS = [export_blueprint]
+# "stream": write the export to the response as the rows are fetched
+# "file": write it to OPENEDX_EXPORT_DIR first, then send it
+OPENEDX_EXPORT_MODE = "{{ SUPERSET_EXPORT_MODE }}"
+OPENEDX_EXPORT_DIR = "{{ SUPERSET_EXPORT_DIR }}"
+# Number of rows fetched, and held in memory, at a time
+OPENEDX_EXPORT_CHUNK_SIZE = int({{ SUPERSET_EXPORT_CHUNK_SIZE }})
+# Maximum number of exported rows, 0 for unlimited
+OPENEDX_EXPORT_MAX_ROWS = int({{ SUPERSET_EXPORT_MAX_ROWS }})
+
+# Dashboards (ids or slugs) whose charts are refreshed by the openedx.warm_dashboards task
+CACHE_WARMUP_DASHBOARDS = {{ SUPERSET_CACHE_WARMUP_DASHBOARDS }}
+# Users to warm the dashboards for, e.g. one per role
+CACHE_WARMUP_USERNAMES = {{ SUPERSET_CACHE_WARMUP_USERNAMES }}
+# Also warm the dashboards for up to this many of the most recently active users
+CACHE_WARMUP_MAX_ACTIVE_USERS = int({{ SUPERSET_CACHE_WARMUP_MAX_ACTIVE_USERS }})
+# Maximum number of Celery worker slots used by the warm-up at any time
+CACHE_WARMUP_CONCURRENCY = int({{ SUPERSET_CACHE_WARMUP_CONCURRENCY }})
+
+{% if SUPERSET_METRICS_STATSD_HOST %}
+# Send Superset's metrics, and the Open edX access metrics, to StatsD
+from superset.stats_logger import StatsdStatsLogger
+
+STATS_LOGGER = StatsdStatsLogger(
+    host="{{ SUPERSET_METRICS_STATSD_HOST }}",
+    port=int({{ SUPERSET_METRICS_STATSD_PORT }}),
+    prefix="{{ SUPERSET_METRICS_STATSD_PREFIX }}",
+)
+{% endif %}
+
 {% if not ENABLE_WEB_PROXY %}
 # Caddy is running behind a proxy: Superset needs to handle x-forwarded-* headers
 # https://flask.palletsprojects.com/en/latest/deploying/proxy_fix/
@@ -8,3 +8,13 @@
     --scopes "user_id" \
     --update \
     superset-sso superset
+
+# Create a global staff service user, and a DOT application with its credentials, so
+# that superset-warm-access can list the courses of any user
+./manage.py lms manage_user --staff superset-service superset-service@apache
+./manage.py lms create_dot_application \
+    --grant-type client-credentials \
+    --client-id {{ SUPERSET_OPENEDX_SERVICE_CLIENT_ID }} \
+    --client-secret {{ SUPERSET_OPENEDX_SERVICE_CLIENT_SECRET }} \
+    --update \
+    superset-service superset-service
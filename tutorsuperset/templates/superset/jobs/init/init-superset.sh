@@ -27,44 +27,9 @@ set -e
 #
 /usr/bin/env bash /app/docker/docker-bootstrap.sh
 
-STEP_CNT=3
-
-echo_step() {
-cat <<EOF
-
-######################################################################
-
-
-Init Step ${1}/${STEP_CNT} [${2}] -- ${3}
-
-
-######################################################################
-
-EOF
-}
-# Initialize the database
-echo_step "1" "Starting" "Applying DB migrations"
-superset db upgrade
-superset init
-echo_step "1" "Complete" "Applying DB migrations"
-
-# Create an admin user
-echo_step "2" "Starting" "Setting up admin user"
-superset fab create-admin \
-  --username "{{ SUPERSET_ADMIN_USERNAME }}" \
-  --password "{{ SUPERSET_ADMIN_PASSWORD }}" \
-  --firstname Superset \
-  --lastname Admin \
-  --email "{{ SUPERSET_ADMIN_EMAIL }}"
-
-# Update the password of the Admin user
-# (in case it changed since the user was created)
-superset fab reset-password \
-  --username "{{ SUPERSET_ADMIN_USERNAME }}" \
-  --password "{{ SUPERSET_ADMIN_PASSWORD }}"
-echo_step "2" "Complete" "Setting up admin user"
-
-# Create default roles and permissions
-echo_step "3" "Starting" "Setting up roles and perms"
-superset fab import-roles -p /app/data/roles.json
-echo_step "3" "Complete" "Setting up roles and perms"
+# Apply the DB migrations, set up the admin user and import the roles and perms.
+# Steps whose inputs did not change since the last init are skipped.
+SUPERSET_ADMIN_USERNAME="{{ SUPERSET_ADMIN_USERNAME }}" \
+SUPERSET_ADMIN_PASSWORD="{{ SUPERSET_ADMIN_PASSWORD }}" \
+SUPERSET_ADMIN_EMAIL="{{ SUPERSET_ADMIN_EMAIL }}" \
+  python /app/pythonpath/openedx_init.py --roles /app/data/roles.json